@@ -0,0 +1,264 @@
+"""
+Bulk import and export of keyword commands and accounts.
+
+    python bulk_io.py export commands --channel "#reptile9lol" > commands.jsonl
+    python bulk_io.py import commands commands.jsonl --channel "#gcorebyte" --on-conflict skip --dry-run
+    python bulk_io.py export accounts --format csv --output accounts.csv
+    python bulk_io.py import accounts accounts.csv --on-conflict replace
+
+Imports run in a single transaction with executemany in batches, so a failed or dry run leaves the database untouched.
+"""
+import argparse
+import csv
+import json
+import sys
+from dotenv import load_dotenv
+
+from db import Database
+from riot_client import PLATFORM_REGIONS
+
+BATCH_SIZE = 500
+COMMAND_FIELDS = ["name", "channel_name", "keywords", "message"]
+ACCOUNT_FIELDS = ["name", "tag", "puuid", "platform", "channel_name"]
+
+
+class BulkImportError(Exception):
+    pass
+
+
+def read_rows(file, file_format: str):
+    """Yield (line number, row dict) without loading the whole file"""
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                yield line_number, json.loads(line)
+
+
+def write_rows(rows, file, file_format: str, fields: list[str]):
+    if file_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    else:
+        for row in rows:
+            file.write(json.dumps(row) + "\n")
+
+
+def _normalize(value):
+    return (value or "").lower().strip()
+
+
+def validate_command(row: dict, channel: str | None):
+    keywords = row.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    keywords = [_normalize(keyword) for keyword in keywords if keyword.strip()]
+    command = {
+        "name": _normalize(row.get("name")),
+        "channel_name": _normalize(channel or row.get("channel_name")),
+        "keywords": ", ".join(keywords),
+        "message": (row.get("message") or "").strip(),
+    }
+    missing = [key for key, value in command.items() if not value]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if " " in command["name"]:
+        raise ValueError("name can't contain spaces")
+    if not command["channel_name"].startswith("#"):
+        raise ValueError("channel_name must start with #")
+    return command
+
+
+def validate_account(row: dict, channel: str | None):
+    account = {
+        "name": _normalize(row.get("name")),
+        "tag": _normalize(row.get("tag")),
+        "puuid": (row.get("puuid") or "").strip() or None,
+        "platform": _normalize(row.get("platform")) or None,
+        "channel_name": _normalize(channel or row.get("channel_name")),
+    }
+    missing = [key for key in ("name", "tag", "channel_name") if not account[key]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if not account["channel_name"].startswith("#"):
+        raise ValueError("channel_name must start with #")
+    if account["platform"] is not None and account["platform"] not in PLATFORM_REGIONS:
+        raise ValueError(f"unknown platform {account['platform']}")
+    return account
+
+
+def export_commands(db: Database, channel: str | None):
+    cursor = db.cursor()
+    if channel:
+        cursor.execute("SELECT * FROM commands WHERE channel_name = ? ORDER BY id", (_normalize(channel),))
+    else:
+        cursor.execute("SELECT * FROM commands ORDER BY id")
+    while records := cursor.fetchmany(BATCH_SIZE):
+        for record in records:
+            yield {
+                "name": record["name"],
+                "channel_name": record["channel_name"],
+                "keywords": [keyword.strip() for keyword in record["keywords"].split(",")],
+                "message": record["message"],
+            }
+
+
+def export_accounts(db: Database, channel: str | None):
+    cursor = db.cursor()
+    query = "SELECT accounts.name, accounts.tag, accounts.puuid, accounts.platform, channel_accounts.channel_name FROM accounts JOIN channel_accounts ON channel_accounts.account_id = accounts.id"
+    if channel:
+        cursor.execute(query + " WHERE channel_accounts.channel_name = ? ORDER BY accounts.id", (_normalize(channel),))
+    else:
+        cursor.execute(query + " ORDER BY accounts.id")
+    while records := cursor.fetchmany(BATCH_SIZE):
+        for record in records:
+            yield dict(record)
+
+
+class Importer:
+    def __init__(self, db: Database, on_conflict: str):
+        self.db = db
+        self.on_conflict = on_conflict
+        self.counts = {"inserted": 0, "updated": 0, "skipped": 0, "invalid": 0}
+        self.existing: set[tuple] = set()
+
+    def _split(self, batch: list[tuple[int, tuple, dict]]):
+        inserts = []
+        updates = []
+        for line_number, key, row in batch:
+            if key in self.existing:
+                if self.on_conflict == "fail":
+                    raise BulkImportError(f"line {line_number}: {key} already exists")
+                if self.on_conflict == "skip":
+                    self.counts["skipped"] += 1
+                    continue
+                updates.append(row)
+            else:
+                self.existing.add(key)
+                inserts.append(row)
+        self.counts["inserted"] += len(inserts)
+        self.counts["updated"] += len(updates)
+        return inserts, updates
+
+    def run(self, rows, validate, key_for, load_existing, write_batch, channel: str | None):
+        self.existing = load_existing()
+        batch = []
+        for line_number, row in rows:
+            try:
+                row = validate(row, channel)
+            except (ValueError, AttributeError) as e:
+                self.counts["invalid"] += 1
+                print(f"line {line_number}: skipping invalid row: {e}", file=sys.stderr)
+                continue
+            batch.append((line_number, key_for(row), row))
+            if len(batch) >= BATCH_SIZE:
+                write_batch(*self._split(batch))
+                batch = []
+        if batch:
+            write_batch(*self._split(batch))
+
+
+def import_commands(db: Database, importer: Importer, rows, channel: str | None):
+    def load_existing():
+        return {(record["channel_name"], record["name"]) for record in db.conn.execute("SELECT name, channel_name FROM commands")}
+
+    def write_batch(inserts, updates):
+        db.conn.executemany(
+            "INSERT INTO commands (name, channel_name, keywords, message) VALUES (:name, :channel_name, :keywords, :message)", inserts
+        )
+        db.conn.executemany(
+            "UPDATE commands SET keywords = :keywords, message = :message WHERE name = :name AND channel_name = :channel_name", updates
+        )
+
+    importer.run(rows, validate_command, lambda row: (row["channel_name"], row["name"]), load_existing, write_batch, channel)
+
+
+def import_accounts(db: Database, importer: Importer, rows, channel: str | None):
+    def load_existing():
+        return {
+            (record["channel_name"], record["name"], record["tag"])
+            for record in db.conn.execute("SELECT channel_accounts.channel_name, accounts.name, accounts.tag FROM accounts JOIN channel_accounts ON channel_accounts.account_id = accounts.id")
+        }
+
+    def write_batch(inserts, updates):
+        # Accounts are shared between channels, only create the ones that don't exist yet
+        db.conn.executemany(
+            "INSERT INTO accounts (name, tag, puuid, platform) SELECT :name, :tag, :puuid, :platform WHERE NOT EXISTS (SELECT 1 FROM accounts WHERE name = :name AND tag = :tag)", inserts
+        )
+        db.conn.executemany(
+            "INSERT OR IGNORE INTO channel_accounts (channel_name, account_id) SELECT :channel_name, id FROM accounts WHERE name = :name AND tag = :tag", inserts
+        )
+        db.conn.executemany(
+            "UPDATE accounts SET puuid = COALESCE(:puuid, puuid), platform = COALESCE(:platform, platform) WHERE name = :name AND tag = :tag", updates
+        )
+
+    importer.run(rows, validate_account, lambda row: (row["channel_name"], row["name"], row["tag"]), load_existing, write_batch, channel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of keyword commands and accounts")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("table", choices=["commands", "accounts"])
+    export_parser.add_argument("--channel", help="only export this channel")
+    export_parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    export_parser.add_argument("--output", help="file to write to, defaults to stdout")
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("table", choices=["commands", "accounts"])
+    import_parser.add_argument("file", help="file to read from, - for stdin")
+    import_parser.add_argument("--channel", help="import every row into this channel, useful for cloning commands")
+    import_parser.add_argument("--format", choices=["jsonl", "csv"], help="defaults to the file extension")
+    import_parser.add_argument("--on-conflict", choices=["skip", "replace", "fail"], default="skip")
+    import_parser.add_argument("--dry-run", action="store_true", help="validate and count without writing anything")
+
+    args = parser.parse_args()
+    load_dotenv()
+    db = Database()
+    db.create_tables()
+
+    if args.action == "export":
+        rows = export_commands(db, args.channel) if args.table == "commands" else export_accounts(db, args.channel)
+        fields = COMMAND_FIELDS if args.table == "commands" else ACCOUNT_FIELDS
+        if args.format == "csv" and args.table == "commands":
+            rows = ({**row, "keywords": ",".join(row["keywords"])} for row in rows)
+        if args.output:
+            with open(args.output, "w", newline="") as file:
+                write_rows(rows, file, args.format, fields)
+        else:
+            write_rows(rows, sys.stdout, args.format, fields)
+        return
+
+    file_format = args.format or ("csv" if args.file.endswith(".csv") else "jsonl")
+    file = sys.stdin if args.file == "-" else open(args.file, newline="")
+    importer = Importer(db, args.on_conflict)
+    try:
+        rows = read_rows(file, file_format)
+        if args.table == "commands":
+            import_commands(db, importer, rows, args.channel)
+        else:
+            import_accounts(db, importer, rows, args.channel)
+        if args.dry_run:
+            db.conn.rollback()
+        else:
+            db.conn.commit()
+    except (BulkImportError, json.JSONDecodeError, csv.Error) as e:
+        db.conn.rollback()
+        print(f"Import aborted, nothing was written: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+    summary = ", ".join(f"{count} {name}" for name, count in importer.counts.items())
+    print(f"{'Dry run: ' if args.dry_run else ''}{summary}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
 import time
+from log import get_logger
+
+log = get_logger("ChampionCache")
 
 CACHE_DURATION = 60 * 60 * 24 * 7 # 1 week, this will basically never change for this use case
 
@@ -13,7 +16,7 @@ class ChampionCache:
         if self.data and (now - self.last_fetched < CACHE_DURATION):
             return self.data
 
-        print("[ChampionCache] Refreshing champion data...")
+        log.info("Refreshing champion data...")
         url = "https://raw.communitydragon.org/latest/plugins/rcp-be-lol-game-data/global/default/v1/champion-summary.json"
         async with session.get(url) as resp:
             if resp.status == 200:
@@ -23,5 +26,16 @@ class ChampionCache:
                 for obj in self.raw_data:
                     self.data[obj["id"]] = obj
             else:
-                print(f"[ChampionCache] Failed to fetch: {resp.status}")
-        return self.data
\ No newline at end of file
+                log.warning("Failed to fetch", upstream="communitydragon", status=resp.status)
+        return self.data
+
+    def snapshot(self):
+        if not self.data:
+            return None
+        return {"raw_data": self.raw_data, "last_fetched": self.last_fetched}
+
+    def restore(self, snapshot: dict):
+        # Rebuilt from the raw data, JSON would have turned the integer ids into strings
+        self.raw_data = snapshot["raw_data"]
+        self.last_fetched = snapshot["last_fetched"]
+        self.data = {obj["id"]: obj for obj in self.raw_data}
@@ -0,0 +1,256 @@
+"""
+Append-only archive of chat messages, one directory per channel.
+
+Lines are buffered in memory and written in batches by a background task. The active segment
+of a channel is a plain <start>.log file, it is rotated once it grows too big or too old and
+rotated segments are gzipped to <start>.log.gz. Every line is "<unix timestamp> <raw IRC line>".
+
+    python chat_archive.py show "#reptile9lol" --since 2026-10-01T18:00 --limit 50
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import re
+import shutil
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from dotenv import load_dotenv
+
+from log import get_logger
+
+log = get_logger("ChatArchive")
+
+DEFAULT_ARCHIVE_DIR = "chat_archive"
+FLUSH_INTERVAL = 5
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+MAX_SEGMENT_AGE = 24 * 3600
+# Lines kept in memory if writing falls behind, the oldest ones are dropped first
+MAX_BUFFERED_LINES = 20000
+
+PRIVMSG_PATTERN = re.compile(r"^(?:@\S+ )?:([^!\s]+)!\S+ PRIVMSG (#[^\s:]+) :(.*)$")
+
+
+@dataclass
+class ArchivedMessage:
+    timestamp: float
+    channel: str
+    user: str
+    content: str
+    # Pass this to TwitchBot.handle_command to replay the message
+    raw: str
+
+
+@dataclass
+class Segment:
+    path: str
+    started_at: int
+    size: int
+    file: object
+
+
+def _channel_dir(directory: str, channel: str):
+    return os.path.join(directory, channel.lower().strip().removeprefix("#"))
+
+
+def _segment_start(filename: str):
+    try:
+        return int(filename.split(".", 1)[0])
+    except ValueError:
+        return None
+
+
+def parse_line(line: str, channel: str | None = None):
+    """Parse one archived line, returns None for lines that aren't chat messages or were cut off by a crash"""
+    timestamp, _, raw = line.rstrip("\n").partition(" ")
+    match = PRIVMSG_PATTERN.match(raw)
+    if match is None:
+        return None
+    try:
+        timestamp = float(timestamp)
+    except ValueError:
+        return None
+    user, message_channel, content = match.groups()
+    if channel is not None and message_channel.lower() != channel:
+        return None
+    return ArchivedMessage(timestamp=timestamp, channel=message_channel, user=user, content=content, raw=raw)
+
+
+def read_messages(channel: str, since: float | None = None, until: float | None = None,
+                  directory: str = DEFAULT_ARCHIVE_DIR):
+    """Yield archived messages of a channel in order, reading one segment at a time"""
+    # Accept the channel with or without the #, messages are matched on the # form
+    channel = "#" + channel.lower().strip().removeprefix("#")
+    channel_dir = _channel_dir(directory, channel)
+    if not os.path.isdir(channel_dir):
+        return
+    segments = sorted(
+        (start, filename) for filename in os.listdir(channel_dir)
+        if (start := _segment_start(filename)) is not None and filename.endswith((".log", ".log.gz"))
+    )
+    for index, (start, filename) in enumerate(segments):
+        # A segment ends where the next one starts, skip the ones that are entirely before since
+        if since is not None and index + 1 < len(segments) and segments[index + 1][0] < since:
+            continue
+        if until is not None and start > until:
+            break
+        path = os.path.join(channel_dir, filename)
+        opener = gzip.open if filename.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8", errors="replace") as file:
+                for line in file:
+                    message = parse_line(line, channel)
+                    if message is None:
+                        continue
+                    if since is not None and message.timestamp < since:
+                        continue
+                    if until is not None and message.timestamp > until:
+                        return
+                    yield message
+        except (OSError, EOFError) as e:
+            # A gzip that was cut off still yields everything before the damage
+            log.warning(f"Could not read {path} to the end: {e}")
+
+
+class ChatArchive:
+    def __init__(self, directory: str | None = None, max_segment_bytes: int = MAX_SEGMENT_BYTES,
+                 max_segment_age: int = MAX_SEGMENT_AGE):
+        self.directory = directory if directory is not None else os.getenv("CHAT_ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+        self.enabled = bool(self.directory)
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.buffer: deque[tuple[float, str]] = deque(maxlen=MAX_BUFFERED_LINES)
+        self.dropped = 0
+        # channel -> active segment, only touched from the writer thread
+        self.segments: dict[str, Segment] = {}
+        self._flush_lock = asyncio.Lock()
+        self._writing = None
+
+    def append(self, line: str):
+        """Called from the read loop, only queues the line"""
+        if not self.enabled:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((time.time(), line))
+
+    async def flush(self):
+        async with self._flush_lock:
+            batch = list(self.buffer)
+            self.buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+            if dropped:
+                log.warning("Archive fell behind, dropped lines", dropped=dropped)
+            if batch or self.segments:
+                # Shielded so cancelling the flush task can't leave the writer thread running unnoticed
+                self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, batch))
+                await asyncio.shield(self._writing)
+
+    async def flush_forever(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"Error while flushing: {e}")
+
+    async def close(self):
+        if self._writing is not None and not self._writing.done():
+            await asyncio.wait([self._writing])
+        await self.flush()
+        await asyncio.to_thread(self._close_segments)
+
+    def _write(self, batch: list[tuple[float, str]]):
+        by_channel: dict[str, list[str]] = {}
+        for timestamp, line in batch:
+            match = PRIVMSG_PATTERN.match(line)
+            if match is None:
+                continue
+            by_channel.setdefault(match.group(2).lower(), []).append(f"{timestamp:.3f} {line}\n")
+
+        for channel, lines in by_channel.items():
+            segment = self._segment_for(channel, int(time.time()))
+            data = "".join(lines).encode()
+            segment.file.write(data)
+            segment.file.flush()
+            segment.size += len(data)
+
+        # Idle channels still rotate once their segment is old enough
+        now = int(time.time())
+        for channel, segment in list(self.segments.items()):
+            if segment.size >= self.max_segment_bytes or now - segment.started_at >= self.max_segment_age:
+                self._rotate(channel)
+
+    def _segment_for(self, channel: str, now: int):
+        segment = self.segments.get(channel)
+        if segment is not None:
+            return segment
+        channel_dir = _channel_dir(self.directory, channel)
+        os.makedirs(channel_dir, exist_ok=True)
+        # Pick up the segment a previous run left behind, compress anything older
+        leftovers = sorted(
+            (start, filename) for filename in os.listdir(channel_dir)
+            if filename.endswith(".log") and (start := _segment_start(filename)) is not None
+        )
+        for start, filename in leftovers[:-1]:
+            self._compress(os.path.join(channel_dir, filename))
+        started_at = leftovers[-1][0] if leftovers else now
+        # Never reuse the start of a segment that was just rotated
+        while not leftovers and os.path.exists(os.path.join(channel_dir, f"{started_at}.log.gz")):
+            started_at += 1
+        path = os.path.join(channel_dir, f"{started_at}.log")
+        file = open(path, "ab")
+        segment = Segment(path=path, started_at=started_at, size=file.tell(), file=file)
+        self.segments[channel] = segment
+        return segment
+
+    def _rotate(self, channel: str):
+        segment = self.segments.pop(channel)
+        segment.file.close()
+        self._compress(segment.path)
+        log.info("Rotated chat archive segment", channel=channel, size=segment.size)
+
+    def _compress(self, path: str):
+        # Write to a temporary file first so a crash never leaves a half written .gz behind
+        with open(path, "rb") as source, gzip.open(path + ".gz.tmp", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+
+    def _close_segments(self):
+        for segment in self.segments.values():
+            segment.file.close()
+        self.segments.clear()
+
+
+def _parse_time(value: str | None):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the chat archive")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    show_parser = subparsers.add_parser("show")
+    show_parser.add_argument("channel")
+    show_parser.add_argument("--since", help="ISO timestamp, local time unless an offset is given")
+    show_parser.add_argument("--until", help="ISO timestamp, local time unless an offset is given")
+    show_parser.add_argument("--limit", type=int)
+    show_parser.add_argument("--raw", action="store_true", help="print the raw IRC lines")
+
+    args = parser.parse_args()
+    load_dotenv()
+    directory = os.getenv("CHAT_ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+    messages = read_messages(args.channel, _parse_time(args.since), _parse_time(args.until), directory)
+    for count, message in enumerate(messages, start=1):
+        if args.raw:
+            print(message.raw)
+        else:
+            print(f"{datetime.fromtimestamp(message.timestamp).isoformat(timespec='seconds')} {message.user}: {message.content}")
+        if args.limit and count >= args.limit:
+            break
+
+
+if __name__ == "__main__":
+    main()
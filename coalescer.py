@@ -0,0 +1,67 @@
+import asyncio
+import inspect
+import time
+
+from log import get_logger
+from profiler import profiler
+
+log = get_logger("Coalescer")
+
+
+class ResponseCoalescer:
+    """
+    Collects identical commands per (channel, key) for a short window, computes the answer once
+    and replies to everyone who asked in a single message.
+    """
+    def __init__(self, reply, spawn):
+        # reply(users, channel, message)
+        self.reply = reply
+        # spawn(name, coroutine) -> task, or None if the task was dropped
+        self.spawn = spawn
+        self.pending: dict[tuple[str, str], list[str]] = {}
+
+    def is_open(self, channel: str, key: str):
+        return (channel, key) in self.pending
+
+    def submit(self, channel: str, key: str, user: str, window: float, compute):
+        """Join the open window for this key, or open one. compute() may return a string or an awaitable."""
+        users = self.pending.get((channel, key))
+        if users is not None:
+            if user not in users:
+                users.append(user)
+            return
+        users = [user]
+        self.pending[(channel, key)] = users
+        command = key.split(" ", 1)[0]
+        task = self.spawn(command, self._run(channel, key, users, window, compute))
+        if task is None:
+            del self.pending[(channel, key)]
+            return
+        # The task can be cancelled before it even starts, don't leave the window open forever
+        task.add_done_callback(lambda _: self._close(channel, key, users))
+
+    def _close(self, channel: str, key: str, users: list[str]):
+        # A new window for the same key may have been opened in the meantime
+        if self.pending.get((channel, key)) is users:
+            del self.pending[(channel, key)]
+
+    async def _compute(self, key: str, compute):
+        with profiler.span(key):
+            result = compute()
+            if inspect.isawaitable(result):
+                result = await result
+        return result
+
+    async def _run(self, channel: str, key: str, users: list[str], window: float, compute):
+        started_at = time.perf_counter()
+        try:
+            # The answer is computed right away, the window only decides how long we keep collecting users
+            result, _ = await asyncio.gather(self._compute(key, compute), asyncio.sleep(window))
+        except Exception as e:
+            log.exception(f"Error in {key}: {e}", channel=channel, command=key)
+            result = f"Error: {e}"
+        finally:
+            self._close(channel, key, users)
+        self.reply(users, channel, result)
+        log.info("Handled command", channel=channel, command=key, requesters=len(users),
+                 latency_ms=round((time.perf_counter() - started_at) * 1000))
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from log import get_logger
+
+log = get_logger("CutoffService")
+
+# Ladder cutoffs are recalculated once a day at 1:45 GMT+3 (22:45 UTC)
+UPDATE_HOUR = 22
+UPDATE_MINUTE = 45
+# Give deeplol a few minutes to pick up the new cutoffs before pre-warming
+PREWARM_DELAY = 60 * 5
+PREWARM_RETRY_DELAY = 60
+CACHE_FILE = "cutoff_cache.json"
+
+
+class CutoffService:
+    def __init__(self, deeplol, stream_status, cache_file: str = CACHE_FILE):
+        self.deeplol = deeplol
+        self.stream_status = stream_status
+        self.cache_file = cache_file
+        self.data = None
+        self.fetched_at = 0
+        # Last time deeplol was asked, successful or not
+        self.attempted_at = 0
+        self._inflight = None
+        self._load()
+
+    def next_update(self, now: float) -> float:
+        now_dt = datetime.fromtimestamp(now, tz=timezone.utc)
+        target = now_dt.replace(hour=UPDATE_HOUR, minute=UPDATE_MINUTE, second=0, microsecond=0)
+        if target <= now_dt:
+            target += timedelta(days=1)
+        return target.timestamp()
+
+    def last_update(self, now: float) -> float:
+        return self.next_update(now) - 24 * 3600
+
+    def is_fresh(self, now: float) -> bool:
+        # Anything fetched before deeplol had time to pick up the update may still be yesterday's cutoffs
+        return self.data is not None and self.fetched_at >= self.last_update(now) + PREWARM_DELAY
+
+    def time_to_update(self, now: float) -> str:
+        remaining_seconds = int(self.next_update(now) - now)
+        hours = remaining_seconds // 3600
+        minutes = (remaining_seconds % 3600) // 60
+        seconds = remaining_seconds % 60
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+    async def get(self):
+        """Return the cached cutoffs, fetching them at most once per update window"""
+        now = time.time()
+        # While deeplol is down or hasn't updated yet, serve the last known value instead of asking on every call
+        if self.is_fresh(now) or now - self.attempted_at < PREWARM_RETRY_DELAY:
+            return self.data
+        return await self.refresh()
+
+    async def refresh(self):
+        # Single-flight: concurrent callers share one upstream request
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._fetch())
+        return await asyncio.shield(self._inflight)
+
+    async def _fetch(self):
+        self.attempted_at = time.time()
+        try:
+            data = await self.deeplol.get_cutoff_data()
+            if data is None:
+                log.warning("Failed to fetch cutoffs, serving last known value", upstream="deeplol")
+                return self.data
+            self.data = data
+            self.fetched_at = time.time()
+            self._save()
+            return self.data
+        finally:
+            self._inflight = None
+
+    async def prewarm_forever(self):
+        """Refresh the cutoffs shortly after every daily update"""
+        while True:
+            # Nobody asks for cutoffs while every channel is offline
+            await self.stream_status.wait_for_online_channels()
+            if not self.is_fresh(time.time()):
+                await self._safe_refresh()
+                if not self.is_fresh(time.time()):
+                    # Keep retrying if deeplol was unreachable
+                    await asyncio.sleep(PREWARM_RETRY_DELAY)
+                    continue
+            now = time.time()
+            await asyncio.sleep(self.next_update(now) + PREWARM_DELAY - now)
+
+    async def _safe_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            log.error(f"Error while pre-warming: {e}", upstream="deeplol")
+
+    def _load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            self.data = cached["data"]
+            self.fetched_at = cached["fetched_at"]
+        except (OSError, ValueError, KeyError) as e:
+            log.warning(f"Ignoring unreadable cache file: {e}")
+
+    def _save(self):
+        try:
+            with open(self.cache_file, "w") as f:
+                json.dump({"data": self.data, "fetched_at": self.fetched_at}, f)
+        except OSError as e:
+            log.error(f"Failed to write cache file: {e}")
@@ -1,5 +1,19 @@
+import os
 import sqlite3
 from dataclasses import dataclass
+from datetime import datetime, timezone
+
+# channel name -> accounts tracked in that channel, shared by every Database instance
+_accounts_by_channel_cache: dict[str, list["Account"]] = {}
+
+
+def invalidate_account_cache():
+    _accounts_by_channel_cache.clear()
+
+
+def season_of(timestamp: float):
+    # Same boundary as lp_history.start_of_season, a season is named after the year it starts in
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).year
 
 
 @dataclass
@@ -7,6 +21,8 @@ class Account:
     name: str
     tag: str
     puuid: str | None = None
+    # Platform routing value like euw1 or kr, None means RIOT_PLATFORM
+    platform: str | None = None
     id: int | None = None
     dirty: bool = False
     persisted: bool = False
@@ -16,8 +32,8 @@ class Account:
 
     def __setattr__(self, key, value):
         if getattr(self, key, None) != value:
-            if key == "name" or key == "tag":
-                # Normalize name and tag
+            if key == "name" or key == "tag" or (key == "platform" and value is not None):
+                # Normalize name, tag and platform
                 value = value.lower().strip()
             super().__setattr__(key, value)
             self.dirty = True
@@ -71,11 +87,43 @@ class Command:
         self.persisted = False
         self.id = None
 
+@dataclass
+class RankSnapshot:
+    puuid: str
+    timestamp: int
+    tier: str
+    rank: str
+    league_points: int
+    absolute_lp: int
+
+@dataclass
+class MatchParticipant:
+    match_id: str
+    puuid: str
+    queue_id: int
+    champion_id: int
+    win: bool
+    kills: int
+    deaths: int
+    assists: int
+    game_creation: int
+    game_duration: int
+
+@dataclass
+class ChampionStats:
+    champion_id: int
+    games: int
+    wins: int
+    kills: int
+    deaths: int
+    assists: int
+
 
 class Database:
     def __init__(self):
         self.conn = sqlite3.connect("database.db")
         self.conn.row_factory = sqlite3.Row
+        self._data_version = None
 
     def cursor(self):
         return self.conn.cursor()
@@ -83,11 +131,61 @@ class Database:
     def create_tables(self):
         cursor = self.cursor()
         cursor.execute("CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, tag TEXT NOT NULL, puuid TEXT)")
+        # The primary key doubles as the index for per-channel lookups
+        cursor.execute("CREATE TABLE IF NOT EXISTS channel_accounts (channel_name TEXT NOT NULL, account_id INTEGER NOT NULL, PRIMARY KEY (channel_name, account_id))")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_channel_accounts_account_id ON channel_accounts (account_id)")
         cursor.execute("CREATE TABLE IF NOT EXISTS commands (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, channel_name TEXT NOT NULL, keywords TEXT NOT NULL, message TEXT NOT NULL)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS command_usage (channel_name TEXT NOT NULL, command TEXT NOT NULL, hour INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (channel_name, command, hour))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS rank_snapshots (puuid TEXT NOT NULL, timestamp INTEGER NOT NULL, tier TEXT NOT NULL, rank TEXT NOT NULL, league_points INTEGER NOT NULL, absolute_lp INTEGER NOT NULL)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rank_snapshots_puuid_timestamp ON rank_snapshots (puuid, timestamp)")
+        self._assign_unowned_accounts(os.getenv("TWITCH_CHANNEL"))
+        self._add_column("accounts", "platform", "TEXT")
+        cursor.execute("CREATE TABLE IF NOT EXISTS match_participants (match_id TEXT NOT NULL, puuid TEXT NOT NULL, queue_id INTEGER NOT NULL, champion_id INTEGER NOT NULL, win INTEGER NOT NULL, kills INTEGER NOT NULL, deaths INTEGER NOT NULL, assists INTEGER NOT NULL, game_creation INTEGER NOT NULL, game_duration INTEGER NOT NULL, PRIMARY KEY (match_id, puuid))")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_match_participants_puuid_game_creation ON match_participants (puuid, game_creation)")
+        self._drop_champion_stats_without_season()
+        cursor.execute("CREATE TABLE IF NOT EXISTS champion_stats (puuid TEXT NOT NULL, champion_id INTEGER NOT NULL, queue_id INTEGER NOT NULL, season INTEGER NOT NULL, games INTEGER NOT NULL, wins INTEGER NOT NULL, kills INTEGER NOT NULL, deaths INTEGER NOT NULL, assists INTEGER NOT NULL, PRIMARY KEY (puuid, champion_id, queue_id, season))")
+        if cursor.execute("SELECT 1 FROM champion_stats LIMIT 1").fetchone() is None:
+            self._rebuild_champion_stats()
+
+    def _assign_unowned_accounts(self, channel_name: str | None):
+        # Accounts added before accounts were per-channel belong to the main channel
+        if not channel_name:
+            return
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO channel_accounts (channel_name, account_id) SELECT ?, id FROM accounts WHERE id NOT IN (SELECT account_id FROM channel_accounts)",
+                (channel_name.lower().strip(),)
+            )
+        invalidate_account_cache()
+
+    def _drop_champion_stats_without_season(self):
+        # The season is part of the primary key, older tables can't be altered and are rebuilt instead
+        columns = [record["name"] for record in self.conn.execute("PRAGMA table_info(champion_stats)")]
+        if columns and "season" not in columns:
+            with self.conn:
+                self.conn.execute("DROP TABLE champion_stats")
+
+    def _rebuild_champion_stats(self):
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO champion_stats (puuid, champion_id, queue_id, season, games, wins, kills, deaths, assists)
+                SELECT puuid, champion_id, queue_id, CAST(strftime('%Y', game_creation / 1000, 'unixepoch') AS INTEGER) AS season,
+                    COUNT(*), SUM(win), SUM(kills), SUM(deaths), SUM(assists)
+                FROM match_participants GROUP BY puuid, champion_id, queue_id, season
+                """
+            )
+
+    def _add_column(self, table: str, column: str, definition: str):
+        # SQLite has no ADD COLUMN IF NOT EXISTS
+        columns = [record["name"] for record in self.conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            with self.conn:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
     def create_account(self, account: Account):
         cursor = self.cursor()
-        cursor.execute("INSERT INTO accounts (name, tag, puuid) VALUES (?, ?, ?)", (account.name, account.tag, account.puuid))
+        cursor.execute("INSERT INTO accounts (name, tag, puuid, platform) VALUES (?, ?, ?, ?)", (account.name, account.tag, account.puuid, account.platform))
         last_row_id = cursor.lastrowid
         self.conn.commit()
         account.id = last_row_id
@@ -96,15 +194,17 @@ class Database:
 
     def delete_account(self, account: Account):
         cursor = self.cursor()
+        cursor.execute("DELETE FROM channel_accounts WHERE account_id = ?", (account.id,))
         cursor.execute("DELETE FROM accounts WHERE id = ?", (account.id,))
         self.conn.commit()
+        invalidate_account_cache()
         return True
 
     def get_account_by_id(self, id: int):
         cursor = self.cursor()
         cursor.execute("SELECT * FROM accounts WHERE id = ?", (id,))
         record = cursor.fetchone()
-        return Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], persisted=True) if record else None
+        return Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], platform=record["platform"], persisted=True) if record else None
 
     def get_account_by_name_and_tag(self, name: str, tag: str):
         # Normalize
@@ -113,19 +213,67 @@ class Database:
         cursor = self.cursor()
         cursor.execute("SELECT * FROM accounts WHERE name = ? AND tag = ?", (name, tag))
         record = cursor.fetchone()
-        return Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], persisted=True) if record else None
+        return Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], platform=record["platform"], persisted=True) if record else None
 
     def get_all_accounts(self):
         cursor = self.cursor()
         cursor.execute("SELECT * FROM accounts ORDER BY id DESC")
         records = cursor.fetchall()
-        return [Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], persisted=True) for record in records]
+        return [Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], platform=record["platform"], persisted=True) for record in records]
 
     def update_account(self, account: Account):
         cursor = self.cursor()
-        cursor.execute("UPDATE accounts SET puuid = ?, name = ? WHERE id = ?", (account.puuid, account.name, account.id))
+        cursor.execute("UPDATE accounts SET puuid = ?, name = ?, platform = ? WHERE id = ?", (account.puuid, account.name, account.platform, account.id))
         self.conn.commit()
+        invalidate_account_cache()
         return account
+
+    def _invalidate_on_external_writes(self):
+        # data_version changes whenever another connection commits, e.g. a bulk import from bulk_io.py
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            invalidate_account_cache()
+
+    def get_accounts_by_channel(self, channel_name: str):
+        channel_name = channel_name.lower().strip()
+        self._invalidate_on_external_writes()
+        if channel_name not in _accounts_by_channel_cache:
+            cursor = self.cursor()
+            cursor.execute(
+                "SELECT accounts.* FROM accounts JOIN channel_accounts ON channel_accounts.account_id = accounts.id WHERE channel_accounts.channel_name = ? ORDER BY accounts.id DESC",
+                (channel_name,)
+            )
+            records = cursor.fetchall()
+            _accounts_by_channel_cache[channel_name] = [Account(id=record["id"], name=record["name"], tag=record["tag"], puuid=record["puuid"], platform=record["platform"], persisted=True) for record in records]
+        return list(_accounts_by_channel_cache[channel_name])
+
+    def get_accounts_by_channels(self, channel_names: list[str]):
+        # Accounts shared between channels are only returned once
+        accounts = {}
+        for channel_name in channel_names:
+            for account in self.get_accounts_by_channel(channel_name):
+                accounts.setdefault(account.id, account)
+        return list(accounts.values())
+
+    def get_channel_count_for_account(self, account: Account):
+        cursor = self.cursor()
+        cursor.execute("SELECT COUNT(*) AS count FROM channel_accounts WHERE account_id = ?", (account.id,))
+        return cursor.fetchone()["count"]
+
+    def add_account_to_channel(self, account: Account, channel_name: str):
+        cursor = self.cursor()
+        cursor.execute("INSERT OR IGNORE INTO channel_accounts (channel_name, account_id) VALUES (?, ?)", (channel_name.lower().strip(), account.id))
+        self.conn.commit()
+        invalidate_account_cache()
+        return cursor.rowcount > 0
+
+    def remove_account_from_channel(self, account: Account, channel_name: str):
+        cursor = self.cursor()
+        cursor.execute("DELETE FROM channel_accounts WHERE channel_name = ? AND account_id = ?", (channel_name.lower().strip(), account.id))
+        self.conn.commit()
+        invalidate_account_cache()
+        return cursor.rowcount > 0
     
     def create_command(self, command: Command):
         cursor = self.cursor()
@@ -195,16 +343,23 @@ class Database:
         records = cursor.fetchall()
         return [Command(id=record["id"], name=record["name"], channel_name=record["channel_name"], keywords=record["keywords"].split(","), message=record["message"], persisted=True) for record in records]
 
-    def find_command_with_most_matching_keywords(self, channel_name: str, search_keywords: list[str]):
+    def _order_by_usage(self, records, usage: dict[str, int] | None):
+        # Most used commands first, so they win ties and are found earlier
+        if not usage:
+            return records
+        return sorted(records, key=lambda record: usage.get(record["name"], 0), reverse=True)
+
+    def find_command_with_most_matching_keywords(self, channel_name: str, search_keywords: list[str], usage: dict[str, int] | None = None):
         """
         Find the command that has the most matching keywords (case-insensitive).
         Returns the command with the highest number of matching keywords, or None if no matches.
+        Ties go to the most used command when usage counts are given.
         """
         cursor = self.cursor()
         
         # Get all commands for the channel
         cursor.execute("SELECT * FROM commands WHERE channel_name = ?", (channel_name.lower().strip(),))
-        records = cursor.fetchall()
+        records = self._order_by_usage(cursor.fetchall(), usage)
         
         if not records:
             return None
@@ -241,16 +396,16 @@ class Database:
         # Only return a match if at least one keyword matched
         return best_match if best_match_count > 0 else None
 
-    def find_command_with_phrase_match(self, channel_name: str, content: str):
+    def find_command_with_phrase_match(self, channel_name: str, content: str, usage: dict[str, int] | None = None):
         """
         Find a command that has a keyword containing spaces that matches the content (case-insensitive).
-        Returns the first matching command, or None if no matches.
+        Returns the first matching command, most used first when usage counts are given, or None if no matches.
         """
         cursor = self.cursor()
         
         # Get all commands for the channel
         cursor.execute("SELECT * FROM commands WHERE channel_name = ?", (channel_name.lower().strip(),))
-        records = cursor.fetchall()
+        records = self._order_by_usage(cursor.fetchall(), usage)
         
         if not records:
             return None
@@ -276,3 +431,128 @@ class Database:
         
         return None
 
+
+    def _rank_snapshot_from_record(self, record):
+        return RankSnapshot(puuid=record["puuid"], timestamp=record["timestamp"], tier=record["tier"], rank=record["rank"], league_points=record["league_points"], absolute_lp=record["absolute_lp"])
+
+    def create_rank_snapshots(self, snapshots: list[RankSnapshot]):
+        # Single transaction for the whole batch
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO rank_snapshots (puuid, timestamp, tier, rank, league_points, absolute_lp) VALUES (?, ?, ?, ?, ?, ?)",
+                [(s.puuid, s.timestamp, s.tier, s.rank, s.league_points, s.absolute_lp) for s in snapshots]
+            )
+        return True
+
+    def get_last_rank_snapshot_before(self, puuid: str, timestamp: int):
+        cursor = self.cursor()
+        cursor.execute("SELECT * FROM rank_snapshots WHERE puuid = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT 1", (puuid, timestamp))
+        record = cursor.fetchone()
+        return self._rank_snapshot_from_record(record) if record else None
+
+    def get_first_rank_snapshot_since(self, puuid: str, timestamp: int):
+        cursor = self.cursor()
+        cursor.execute("SELECT * FROM rank_snapshots WHERE puuid = ? AND timestamp >= ? ORDER BY timestamp ASC LIMIT 1", (puuid, timestamp))
+        record = cursor.fetchone()
+        return self._rank_snapshot_from_record(record) if record else None
+
+    def get_peak_rank_snapshot_since(self, puuid: str, timestamp: int):
+        cursor = self.cursor()
+        cursor.execute("SELECT * FROM rank_snapshots WHERE puuid = ? AND timestamp >= ? ORDER BY absolute_lp DESC, timestamp DESC LIMIT 1", (puuid, timestamp))
+        record = cursor.fetchone()
+        return self._rank_snapshot_from_record(record) if record else None
+
+    def prune_rank_snapshots(self, downsample_before: int, delete_before: int, bucket_size: int):
+        """
+        Delete snapshots older than delete_before and thin out snapshots older than downsample_before
+        to the highest one per bucket_size seconds, so peaks are preserved.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM rank_snapshots WHERE timestamp < ?", (delete_before,))
+            self.conn.execute(
+                """
+                DELETE FROM rank_snapshots WHERE timestamp < ? AND rowid NOT IN (
+                    SELECT keep_rowid FROM (
+                        SELECT rowid AS keep_rowid, MAX(absolute_lp) FROM rank_snapshots
+                        WHERE timestamp < ? GROUP BY puuid, timestamp / ?
+                    )
+                )
+                """,
+                (downsample_before, downsample_before, bucket_size)
+            )
+        return True
+
+    def _match_participant_from_record(self, record):
+        return MatchParticipant(match_id=record["match_id"], puuid=record["puuid"], queue_id=record["queue_id"], champion_id=record["champion_id"], win=bool(record["win"]), kills=record["kills"], deaths=record["deaths"], assists=record["assists"], game_creation=record["game_creation"], game_duration=record["game_duration"])
+
+    def create_match_participants(self, participants: list[MatchParticipant]):
+        """
+        Insert match rows and fold them into champion_stats in the same transaction.
+        Rows that are already stored are skipped so aggregates are never counted twice.
+        """
+        with self.conn:
+            for p in participants:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO match_participants (match_id, puuid, queue_id, champion_id, win, kills, deaths, assists, game_creation, game_duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (p.match_id, p.puuid, p.queue_id, p.champion_id, int(p.win), p.kills, p.deaths, p.assists, p.game_creation, p.game_duration)
+                )
+                if cursor.rowcount == 0:
+                    continue
+                self.conn.execute(
+                    """
+                    INSERT INTO champion_stats (puuid, champion_id, queue_id, season, games, wins, kills, deaths, assists) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                    ON CONFLICT (puuid, champion_id, queue_id, season) DO UPDATE SET
+                        games = games + 1, wins = wins + excluded.wins, kills = kills + excluded.kills,
+                        deaths = deaths + excluded.deaths, assists = assists + excluded.assists
+                    """,
+                    (p.puuid, p.champion_id, p.queue_id, season_of(p.game_creation / 1000), int(p.win), p.kills, p.deaths, p.assists)
+                )
+        return True
+
+    def get_latest_match_participant(self, puuids: list[str]):
+        cursor = self.cursor()
+        placeholders = ", ".join("?" for _ in puuids)
+        cursor.execute(f"SELECT * FROM match_participants WHERE puuid IN ({placeholders}) ORDER BY game_creation DESC LIMIT 1", puuids)
+        record = cursor.fetchone()
+        return self._match_participant_from_record(record) if record else None
+
+    def get_known_match_ids(self, puuid: str, match_ids: list[str]):
+        cursor = self.cursor()
+        placeholders = ", ".join("?" for _ in match_ids)
+        cursor.execute(f"SELECT match_id FROM match_participants WHERE puuid = ? AND match_id IN ({placeholders})", [puuid, *match_ids])
+        return {record["match_id"] for record in cursor.fetchall()}
+
+    def get_champion_stats(self, puuids: list[str], queue_id: int, season: int, champion_id: int | None = None):
+        """Aggregated stats per champion over the given accounts in one season, most played first"""
+        cursor = self.cursor()
+        placeholders = ", ".join("?" for _ in puuids)
+        query = f"SELECT champion_id, SUM(games) AS games, SUM(wins) AS wins, SUM(kills) AS kills, SUM(deaths) AS deaths, SUM(assists) AS assists FROM champion_stats WHERE puuid IN ({placeholders}) AND queue_id = ? AND season = ?"
+        params = [*puuids, queue_id, season]
+        if champion_id is not None:
+            query += " AND champion_id = ?"
+            params.append(champion_id)
+        query += " GROUP BY champion_id ORDER BY games DESC"
+        cursor.execute(query, params)
+        return [ChampionStats(champion_id=record["champion_id"], games=record["games"], wins=record["wins"], kills=record["kills"], deaths=record["deaths"], assists=record["assists"]) for record in cursor.fetchall()]
+
+    def add_command_usage(self, counts: dict[tuple[str, str, int], int]):
+        # Single transaction per flush, no matter how many messages were counted
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO command_usage (channel_name, command, hour, count) VALUES (?, ?, ?, ?) ON CONFLICT (channel_name, command, hour) DO UPDATE SET count = count + excluded.count",
+                [(channel_name, command, hour, count) for (channel_name, command, hour), count in counts.items()]
+            )
+        return True
+
+    def get_command_usage_totals(self):
+        cursor = self.cursor()
+        cursor.execute("SELECT channel_name, command, SUM(count) AS count FROM command_usage GROUP BY channel_name, command")
+        return [(record["channel_name"], record["command"], record["count"]) for record in cursor.fetchall()]
+
+    def get_command_usage_since(self, channel_name: str, hour: int):
+        cursor = self.cursor()
+        cursor.execute(
+            "SELECT command, SUM(count) AS count FROM command_usage WHERE channel_name = ? AND hour >= ? GROUP BY command ORDER BY count DESC",
+            (channel_name.lower().strip(), hour)
+        )
+        return [(record["command"], record["count"]) for record in cursor.fetchall()]
@@ -1,3 +1,5 @@
+from profiler import profiler
+
 DEEPLOL_API_URL = "https://b2c-api-cdn.deeplol.gg/summoner/summoner_rank?platform_id=EUW1&lane=All&page=1"
 
 class DeepLolApi:
@@ -6,9 +8,10 @@ class DeepLolApi:
 
     async def _get_deep_lol_data(self):
         headers = { "Accept": "application/json" }
-        async with self.session.get(DEEPLOL_API_URL, headers=headers) as resp:
-            if resp.status == 200:
-                return await resp.json()
+        with profiler.span("deeplol"):
+            async with self.session.get(DEEPLOL_API_URL, headers=headers) as resp:
+                if resp.status == 200:
+                    return await resp.json()
         return None
 
     async def get_cutoff_data(self):
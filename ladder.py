@@ -0,0 +1,148 @@
+import asyncio
+import bisect
+import time
+
+from db import Account
+from riot_client import format_rank
+from log import get_logger
+
+log = get_logger("Ladder")
+
+REFRESH_INTERVAL = 60 * 10
+# Cutoffs from a mirror older than this aren't trusted, callers fall back to deeplol
+MAX_STALENESS = 60 * 60
+# Highest tier first, a player keeps the tier of the league they are listed in until the daily update
+LADDER_TIERS = ["challenger", "grandmaster", "master"]
+# Apex slots per platform, smaller platforms get the defaults
+CHALLENGER_SLOTS = {"euw1": 300, "kr": 300, "na1": 300}
+GRANDMASTER_SLOTS = {"euw1": 700, "kr": 700, "na1": 700}
+DEFAULT_CHALLENGER_SLOTS = 200
+DEFAULT_GRANDMASTER_SLOTS = 500
+CHALLENGER_MIN_LP = 500
+GRANDMASTER_MIN_LP = 200
+
+
+def _sort_key(tier_index: int, league_points: int, puuid: str):
+    # Sorts best first: most LP, then highest tier
+    return -league_points, tier_index, puuid
+
+
+class LadderMirror:
+    """
+    Local copy of the master+ solo queue ladder of one platform, kept as one list sorted by LP.
+    Refreshes only move the entries that changed, lookups are binary searches.
+    """
+    def __init__(self, riot, stream_status, platform: str | None = None):
+        self.riot = riot
+        self.stream_status = stream_status
+        self.platform = (platform or riot.default_platform).lower().strip()
+        # puuid -> sort key, the key holds everything we need so there is no separate entry object
+        self.entries: dict[str, tuple[int, int, str]] = {}
+        self.ladder: list[tuple[int, int, str]] = []
+        self.refreshed_at = 0
+
+    def is_fresh(self, now: float):
+        return len(self.ladder) > 0 and now - self.refreshed_at <= MAX_STALENESS
+
+    async def refresh(self):
+        leagues = await asyncio.gather(*(self.riot.get_apex_league(tier, self.platform) for tier in LADDER_TIERS))
+        if any(league is None for league in leagues):
+            # A partial ladder would shift every position below the missing league
+            log.warning("Failed to fetch the ladder, keeping the last known one", upstream="riot", platform=self.platform)
+            return False
+
+        fetched = {}
+        for tier_index, league in enumerate(leagues):
+            for entry in league.get("entries", []):
+                puuid = entry.get("puuid")
+                if puuid and puuid not in fetched:
+                    fetched[puuid] = _sort_key(tier_index, entry["leaguePoints"], puuid)
+        self._apply(fetched)
+        self.refreshed_at = time.time()
+        return True
+
+    def _apply(self, fetched: dict[str, tuple[int, int, str]]):
+        removed = [key for puuid, key in self.entries.items() if fetched.get(puuid) != key]
+        added = [key for puuid, key in fetched.items() if self.entries.get(puuid) != key]
+        if len(removed) + len(added) > len(self.ladder) // 2:
+            # Most of the ladder moved (or this is the first load), sorting once is cheaper
+            self.ladder = sorted(fetched.values())
+        else:
+            for key in removed:
+                index = bisect.bisect_left(self.ladder, key)
+                del self.ladder[index]
+            for key in added:
+                bisect.insort(self.ladder, key)
+        dropped = len(self.entries.keys() - fetched.keys())
+        self.entries = fetched
+        log.info("Refreshed ladder", platform=self.platform, players=len(self.ladder), changed=len(added), dropped=dropped)
+
+    def position(self, puuid: str):
+        """1-based ladder position, None if the player is below master"""
+        key = self.entries.get(puuid)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.ladder, key) + 1
+
+    def _lp_at(self, position: int):
+        if position > len(self.ladder):
+            return 0
+        return -self.ladder[position - 1][0]
+
+    def cutoffs(self):
+        if not self.is_fresh(time.time()):
+            return None
+        challenger_slots = CHALLENGER_SLOTS.get(self.platform, DEFAULT_CHALLENGER_SLOTS)
+        grandmaster_slots = GRANDMASTER_SLOTS.get(self.platform, DEFAULT_GRANDMASTER_SLOTS)
+        return {
+            "challenger": max(CHALLENGER_MIN_LP, self._lp_at(challenger_slots)),
+            "grandmaster": max(GRANDMASTER_MIN_LP, self._lp_at(challenger_slots + grandmaster_slots)),
+        }
+
+    def ladder_rank(self, accounts: list[Account]):
+        if not self.is_fresh(time.time()):
+            return None
+        # Only accounts on this platform can be on this ladder
+        accounts = [account for account in accounts
+                    if account.puuid and (account.platform or self.riot.default_platform) == self.platform]
+        best = None
+        for account in accounts:
+            position = self.position(account.puuid)
+            if position is not None and (best is None or position < best[0]):
+                best = (position, account)
+        if best is None:
+            return "Not on the ladder, only master and above is ranked"
+        position, account = best
+        tier_index, league_points = self.entries[account.puuid][1], -self.entries[account.puuid][0]
+        rank = format_rank(LADDER_TIERS[tier_index].upper(), "I", league_points)
+        return f"#{position} on {self.platform.upper()} ({rank}) out of {len(self.ladder)} master+ players"
+
+    def snapshot(self):
+        if not self.ladder:
+            return None
+        entries = [[puuid, tier_index, -negative_lp] for negative_lp, tier_index, puuid in self.ladder]
+        return {"platform": self.platform, "refreshed_at": self.refreshed_at, "entries": entries}
+
+    def restore(self, data: dict):
+        if data["platform"] != self.platform:
+            return
+        self.entries = {puuid: _sort_key(tier_index, league_points, puuid) for puuid, tier_index, league_points in data["entries"]}
+        # Saved in order, no need to sort again
+        self.ladder = list(self.entries.values())
+        self.refreshed_at = data["refreshed_at"]
+        log.info("Restored ladder", platform=self.platform, players=len(self.ladder))
+
+    async def refresh_forever(self):
+        while True:
+            # Nobody asks for the ladder while every channel is offline
+            await self.stream_status.wait_for_online_channels()
+            # A ladder restored from a snapshot is only refreshed once it is due
+            due_in = self.refreshed_at + REFRESH_INTERVAL - time.time()
+            if due_in > 0:
+                await asyncio.sleep(due_in)
+                continue
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.error(f"Error while refreshing the ladder: {e}", upstream="riot")
+            await asyncio.sleep(REFRESH_INTERVAL)
@@ -0,0 +1,170 @@
+import asyncio
+from dataclasses import dataclass, field
+
+from db import Database, Account
+from log import get_logger
+
+log = get_logger("LiveGame")
+
+POLL_INTERVAL = 30
+# Games restored from a snapshot older than this have most likely ended
+SNAPSHOT_MAX_AGE = 60 * 10
+
+
+@dataclass
+class LiveGameSnapshot:
+    """Everything in-game commands need, built once per game since none of it changes mid-game"""
+    game_id: int
+    account: Account
+    match_data: dict
+    participant: dict
+    champion_name: str | None
+    rune_names: list[str]
+    runes_response: str | None
+    champion_response: str | None
+    pros_response: str | None = None
+    pros_task: asyncio.Task | None = field(default=None, repr=False)
+
+
+class LiveGameTracker:
+    def __init__(self, riot, lolpros, stream_status):
+        self.riot = riot
+        self.lolpros = lolpros
+        self.stream_status = stream_status
+        self.db = Database()
+        # gameId -> snapshot
+        self.games: dict[int, LiveGameSnapshot] = {}
+        # channel -> gameId of the game one of its accounts is in
+        self.current_games: dict[str, int] = {}
+
+    def current(self, channel: str) -> LiveGameSnapshot | None:
+        game_id = self.current_games.get(channel.lower().strip())
+        if game_id is None:
+            return None
+        return self.games.get(game_id)
+
+    async def _build(self, account: Account, match: dict):
+        participant = next((p for p in match["participants"] if p["puuid"] == account.puuid), None)
+        if participant is None:
+            return None
+
+        champion_json = await self.riot.champion_cache.get(self.riot.session)
+        champion = champion_json.get(participant["championId"]) if champion_json else None
+        champion_name = champion["name"] if champion else None
+
+        rune_names = []
+        perk_ids = participant.get("perks", {}).get("perkIds", [])
+        runes_json = await self.riot.rune_cache.get(self.riot.session)
+        if runes_json:
+            rune_names = [runes_json[rune_id]["name"] for rune_id in perk_ids if rune_id in runes_json]
+
+        snapshot = LiveGameSnapshot(
+            game_id=match["gameId"],
+            account=account,
+            match_data=match,
+            participant=participant,
+            champion_name=champion_name,
+            rune_names=rune_names,
+            runes_response=", ".join(rune_names) if rune_names else None,
+            champion_response=champion_name
+        )
+        # lolpros is slow, prefetch it so !pros is ready by the time someone asks
+        snapshot.pros_task = asyncio.create_task(self._render_pros(snapshot))
+        log.info("New game found", account=account.full_name(), game_id=snapshot.game_id)
+        return snapshot
+
+    async def _render_pros(self, snapshot: LiveGameSnapshot):
+        data = await self.lolpros.get_game(snapshot.account)
+        if data is None:
+            return None
+        # Shares the Riot client's champion cache, which survives restarts in the state snapshot
+        champion_json = await self.riot.champion_cache.get(self.riot.session)
+        if not champion_json:
+            return None
+        snapshot.pros_response = self.lolpros.get_all_pro_names(snapshot.account, data, champion_json)
+        return snapshot.pros_response
+
+    async def get_pros_response(self, snapshot: LiveGameSnapshot):
+        if snapshot.pros_response is not None:
+            return snapshot.pros_response
+        if snapshot.pros_task is None or (snapshot.pros_task.done() and snapshot.pros_response is None):
+            # The prefetch failed, try again
+            snapshot.pros_task = asyncio.create_task(self._render_pros(snapshot))
+        return await asyncio.shield(snapshot.pros_task)
+
+    async def refresh(self, channels: list[str]):
+        # Every puuid is looked up at most once per refresh, even if several channels track it
+        matches: dict[str, tuple[int, dict | None]] = {}
+        current_games = {}
+        for channel in channels:
+            channel = channel.lower().strip()
+            # Set when a lookup failed, so we can't tell whether the game is still going
+            unknown = False
+            for account in self.db.get_accounts_by_channel(channel):
+                if not account.puuid:
+                    account.puuid = await self.riot.get_puuid(account.name, account.tag, account.platform)
+                    if not account.puuid:
+                        continue
+                    account.save()
+                if account.puuid not in matches:
+                    matches[account.puuid] = await self.riot.get_current_match(account.puuid, account.platform)
+                status, match = matches[account.puuid]
+                if match is None:
+                    unknown = unknown or status != 404
+                    continue
+                if match["gameId"] not in self.games:
+                    snapshot = await self._build(account, match)
+                    if snapshot is None:
+                        continue
+                    self.games[snapshot.game_id] = snapshot
+                current_games[channel] = match["gameId"]
+                break
+            if channel not in current_games and unknown and channel in self.current_games:
+                # Keep the game through a 429 or 5xx, only a 404 means it ended
+                current_games[channel] = self.current_games[channel]
+
+        # Offline channels keep nothing, finished games are dropped
+        self.current_games = current_games
+        for game_id in list(self.games):
+            if game_id not in current_games.values():
+                snapshot = self.games.pop(game_id)
+                if snapshot.pros_task is not None:
+                    snapshot.pros_task.cancel()
+                log.info("Game ended", game_id=game_id)
+
+    def snapshot(self):
+        games = []
+        for snapshot in self.games.values():
+            account = snapshot.account
+            games.append({
+                "game_id": snapshot.game_id,
+                "account": {"id": account.id, "name": account.name, "tag": account.tag, "puuid": account.puuid, "platform": account.platform},
+                "match_data": snapshot.match_data,
+                "participant": snapshot.participant,
+                "champion_name": snapshot.champion_name,
+                "rune_names": snapshot.rune_names,
+                "runes_response": snapshot.runes_response,
+                "champion_response": snapshot.champion_response,
+                "pros_response": snapshot.pros_response,
+            })
+        return {"games": games, "current_games": self.current_games}
+
+    def restore(self, data: dict):
+        # The next refresh still checks every game is live, but doesn't rebuild the ones it already knows
+        for game in data["games"]:
+            account = Account(persisted=True, **game.pop("account"))
+            snapshot = LiveGameSnapshot(account=account, **game)
+            self.games[snapshot.game_id] = snapshot
+        self.current_games = {channel: game_id for channel, game_id in data["current_games"].items() if game_id in self.games}
+        log.info("Restored live games", games=len(self.games))
+
+    async def poll_forever(self):
+        while True:
+            try:
+                # Refreshing with no live channels drops every snapshot
+                await self.refresh(self.stream_status.online_channels())
+            except Exception as e:
+                log.error(f"Error while refreshing live games: {e}", upstream="riot")
+            # Nothing to poll while every channel is offline
+            await self.stream_status.wait_for_online_channels()
+            await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,79 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_LOG_LEVEL = "INFO"
+# Keyword arguments understood by the logging module itself, everything else is a structured field
+RESERVED_KWARGS = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        message = f"{self.formatTime(record)} {record.levelname} [{record.name}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class SamplingFilter(logging.Filter):
+    """Keep roughly sample_rate of the records that set one, used for high-volume events"""
+    def filter(self, record):
+        sample_rate = getattr(record, "sample_rate", 1)
+        return sample_rate >= 1 or random.random() < sample_rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Formatting happens on the writer thread, the caller only pays for the enqueue
+        return record
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    Usage: log.info("Fetched data", upstream="riot", latency_ms=12, sample_rate=0.1)
+    Extra keyword arguments end up as key=value fields on the line.
+    """
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in RESERVED_KWARGS}
+        extra = kwargs.setdefault("extra", {})
+        sample_rate = fields.pop("sample_rate", None)
+        if sample_rate is not None:
+            extra["sample_rate"] = sample_rate
+        extra["fields"] = fields
+        return msg, kwargs
+
+
+def get_logger(name: str):
+    return StructuredLogger(logging.getLogger(name), {})
+
+
+def setup_logging():
+    """Route every log record through a queue to a background writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper())
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    # Flush whatever is still queued on exit
+    atexit.register(_listener.stop)
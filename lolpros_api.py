@@ -1,41 +1,30 @@
 import os
 import asyncio
-from champion_cache import ChampionCache
 from db import Account
+from log import get_logger
+from profiler import profiler
+
+log = get_logger("LolprosApi")
 
 LOLPROS_API_URL = "https://api.lolpros.gg/lol/game"
 
 class LolprosApi:
-    def __init__(self, session, riotApi, twitchBot):
+    def __init__(self, session):
         self.session = session
-        self.twitchBot = twitchBot
-        self.champion_cache = ChampionCache()
-        self.riotApi = riotApi
-        self.last_request_cache = None
         self._request_semaphore = asyncio.Semaphore(1)  # Only allow 1 concurrent request
 
-    async def _get_lolpros_data(self, account: Account, user: str, channel: str):
+    async def get_game(self, account: Account):
+        """Fetch the live game of the account, cached per game by LiveGameTracker"""
         async with self._request_semaphore:
-            if self.last_request_cache is not None:
-                current_game = await self.riotApi.get_current_match(account.puuid)
-                if current_game is None:
-                    print("[LolprosApi] No current game found. Resetting cache.")
-                    self.last_request_cache = None
-                    return [None, False]
-            if self.last_request_cache is not None and current_game['gameId'] == self.last_request_cache['gameId']:
-                print("[LolprosApi] Successful cache hit")
-                return [self.last_request_cache, False]
-            print("[LolprosApi] Cache miss. Fetching new data.")
-            if user is not None and channel is not None:
-                self.twitchBot.send(user, channel, "Fetching data from Lolpros, this might take a bit...")
+            log.info("Fetching live game data", upstream="lolpros", account=account.full_name())
             headers = { "Accept": "application/json", "Host": "api.lolpros.gg", "Lpgg-Server": "NA" }
             params = { "query": account.name, "tagline": account.tag }
-            async with self.session.get(LOLPROS_API_URL, params=params, headers=headers) as resp:
-                if resp.status == 200:
-                    response = await resp.json()
-                    self.last_request_cache = response
-                    return [response, True]
-            return [None, False]
+            with profiler.span("lolpros"):
+                async with self.session.get(LOLPROS_API_URL, params=params, headers=headers) as resp:
+                    if resp.status == 200:
+                        return await resp.json()
+            log.warning("Failed to fetch live game data", upstream="lolpros", status=resp.status)
+            return None
 
     def _dig(self, value, *keys):
         keys = list(keys)
@@ -67,12 +56,7 @@ class LolprosApi:
             return " | Bot"
         return ""
 
-    async def get_all_pro_names(self, account: Account, user: str, channel: str):
-        data, cache_updated = await self._get_lolpros_data(account, user, channel)
-        if data is None:
-            return None
-
-        champion_data = await self.champion_cache.get(self.session)
+    def get_all_pro_names(self, account: Account, data: dict, champion_data: dict):
         red = []
         blue = []
         average_red_lp = 0
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from db import Database, Account, RankSnapshot
+from riot_client import format_rank, APEX_TIERS
+from log import get_logger
+
+log = get_logger("LpHistory")
+
+SAMPLE_INTERVAL = 60 * 5
+FLUSH_INTERVAL = 60
+# Store a snapshot at least this often even if nothing changed
+HEARTBEAT_INTERVAL = 60 * 60
+PRUNE_INTERVAL = 60 * 60 * 24
+# Snapshots older than this are thinned out to one per bucket
+FULL_RESOLUTION_RETENTION = 60 * 60 * 24 * 14
+DOWNSAMPLE_BUCKET = 60 * 60 * 6
+MAX_RETENTION = 60 * 60 * 24 * 365 * 2
+
+TIERS = ["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", "DIAMOND", "MASTER", "GRANDMASTER", "CHALLENGER"]
+DIVISIONS = ["IV", "III", "II", "I"]
+
+
+def absolute_lp(tier: str, rank: str, league_points: int):
+    """LP on a single scale so snapshots from different tiers can be compared"""
+    if tier in APEX_TIERS:
+        # Apex tiers share one LP ladder starting at master
+        return TIERS.index("MASTER") * 400 + league_points
+    return TIERS.index(tier) * 400 + DIVISIONS.index(rank) * 100 + league_points
+
+
+def start_of_day(now: float):
+    return int(datetime.fromtimestamp(now, tz=timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def start_of_season(now: float):
+    # Ranked seasons start in early January
+    return int(datetime(datetime.fromtimestamp(now, tz=timezone.utc).year, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+class LpHistory:
+    def __init__(self, riot, stream_status):
+        self.riot = riot
+        self.stream_status = stream_status
+        self.db = Database()
+        self.pending: list[RankSnapshot] = []
+        # Latest sampled snapshot per puuid, including ones that are not flushed yet
+        self.latest: dict[str, RankSnapshot] = {}
+        self._last_stored_at: dict[str, int] = {}
+
+    def record(self, puuid: str, entry: dict, now: float):
+        snapshot = RankSnapshot(
+            puuid=puuid,
+            timestamp=int(now),
+            tier=entry['tier'],
+            rank=entry['rank'],
+            league_points=entry['leaguePoints'],
+            absolute_lp=absolute_lp(entry['tier'], entry['rank'], entry['leaguePoints'])
+        )
+        previous = self.latest.get(puuid)
+        self.latest[puuid] = snapshot
+        changed = previous is None or previous.absolute_lp != snapshot.absolute_lp or previous.tier != snapshot.tier
+        if changed or now - self._last_stored_at.get(puuid, 0) >= HEARTBEAT_INTERVAL:
+            self.pending.append(snapshot)
+            self._last_stored_at[puuid] = int(now)
+
+    async def _sample_account(self, account: Account):
+        try:
+            entry = await self.riot.get_solo_queue_entry(account)
+            if entry is not None:
+                self.record(account.puuid, entry, time.time())
+        except Exception as e:
+            log.error(f"Error sampling {account.full_name()}: {e}", upstream="riot")
+
+    async def sample(self, accounts: list[Account]):
+        # Every platform has its own rate limit bucket, so accounts on different platforms don't wait on each other
+        await asyncio.gather(*(self._sample_account(account) for account in accounts))
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = []
+        try:
+            # Each batch is one transaction, run off the event loop
+            await asyncio.to_thread(lambda: Database().create_rank_snapshots(batch))
+        except Exception:
+            # e.g. database is locked, keep the batch for the next flush since it won't be recorded again
+            self.pending = batch + self.pending
+            raise
+
+    async def prune(self):
+        now = int(time.time())
+        await asyncio.to_thread(lambda: Database().prune_rank_snapshots(
+            now - FULL_RESOLUTION_RETENTION, now - MAX_RETENTION, DOWNSAMPLE_BUCKET
+        ))
+
+    async def sample_forever(self):
+        while True:
+            # Only spend Riot requests on channels that are live
+            channels = await self.stream_status.wait_for_online_channels()
+            await self.sample(self.db.get_accounts_by_channels(channels))
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    async def flush_forever(self):
+        last_pruned_at = 0
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.time() - last_pruned_at >= PRUNE_INTERVAL:
+                    await self.prune()
+                    last_pruned_at = time.time()
+            except Exception as e:
+                log.error(f"Error while flushing: {e}")
+
+    def _current(self, puuid: str):
+        if puuid in self.latest:
+            return self.latest[puuid]
+        return self.db.get_last_rank_snapshot_before(puuid, int(time.time()) + 1)
+
+    def lp_today(self, accounts: list[Account]):
+        day_start = start_of_day(time.time())
+        results = []
+        for account in accounts:
+            if not account.puuid:
+                continue
+            current = self._current(account.puuid)
+            if current is None:
+                continue
+            # Compare against the last value from before today, or the first one today
+            baseline = self.db.get_last_rank_snapshot_before(account.puuid, day_start)
+            if baseline is None:
+                baseline = self.db.get_first_rank_snapshot_since(account.puuid, day_start) or current
+            delta = current.absolute_lp - baseline.absolute_lp
+            results.append(f"{account.full_name()}: {delta:+d}LP today ({format_rank(current.tier, current.rank, current.league_points)})")
+        if len(results) == 0:
+            return "No LP history yet"
+        return " | ".join(results)
+
+    def peak(self, accounts: list[Account]):
+        season_start = start_of_season(time.time())
+        best = None
+        best_account = None
+        for account in accounts:
+            if not account.puuid:
+                continue
+            candidates = [self.db.get_peak_rank_snapshot_since(account.puuid, season_start), self.latest.get(account.puuid)]
+            for snapshot in candidates:
+                if snapshot is not None and (best is None or snapshot.absolute_lp > best.absolute_lp):
+                    best = snapshot
+                    best_account = account
+        if best is None:
+            return "No LP history yet"
+        peaked_at = datetime.fromtimestamp(best.timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+        return f"Peak this season: {format_rank(best.tier, best.rank, best.league_points)} on {best_account.full_name()} ({peaked_at})"
@@ -3,15 +3,16 @@ import os
 from dotenv import load_dotenv
 
 from db import Database
+from log import setup_logging
 from twitch_bot import TwitchBot
 
 async def main():
     load_dotenv()
+    setup_logging()
     # SQLite3 tables
     Database().create_tables()
     bot = TwitchBot()
-    await bot.connect()
-    await bot.listen()
+    await bot.run()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from db import Database, Account, MatchParticipant, season_of
+from lp_history import start_of_season
+from log import get_logger
+
+log = get_logger("MatchHistory")
+
+INGEST_INTERVAL = 60 * 10
+MAX_CONCURRENT_FETCHES = 4
+MATCH_IDS_PAGE_SIZE = 100
+SOLO_QUEUE_ID = 420
+# Returned for fetches that may succeed later, e.g. a 429 or 5xx
+FETCH_FAILED = object()
+
+
+class MatchHistory:
+    def __init__(self, riot, stream_status):
+        self.riot = riot
+        self.stream_status = stream_status
+        self.db = Database()
+        # Regional host -> semaphore, a region that is rate limited doesn't hold up the others
+        self._fetch_semaphores = defaultdict(lambda: asyncio.Semaphore(MAX_CONCURRENT_FETCHES))
+        # Matches that can never be stored (404 or the player isn't in them), never fetched again
+        self.unavailable_match_ids: set[str] = set()
+
+    async def _get_new_match_ids(self, account: Account):
+        """Newest first, None if any page failed since a partial list would leave a permanent gap"""
+        puuid = account.puuid
+        latest = self.db.get_latest_match_participant([puuid])
+        if latest is None:
+            # First run, backfill the current season
+            start_time = start_of_season(time.time())
+        else:
+            start_time = latest.game_creation // 1000
+
+        match_ids = []
+        start = 0
+        while True:
+            page = await self.riot.get_match_ids(puuid, start_time=start_time, start=start, count=MATCH_IDS_PAGE_SIZE,
+                                                 platform=account.platform)
+            if page is None:
+                return None
+            match_ids.extend(page)
+            if len(page) < MATCH_IDS_PAGE_SIZE:
+                break
+            start += MATCH_IDS_PAGE_SIZE
+
+        if not match_ids:
+            return []
+        known = self.db.get_known_match_ids(puuid, match_ids)
+        return [match_id for match_id in match_ids if match_id not in known and match_id not in self.unavailable_match_ids]
+
+    async def _fetch_participant(self, match_id: str, account: Account):
+        puuid = account.puuid
+        try:
+            async with self._fetch_semaphores[self.riot.region_host(account.platform).name]:
+                status, match = await self.riot.get_match(match_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning(f"Failed to fetch {match_id}: {e}", upstream="riot")
+            return FETCH_FAILED
+        if status == 404:
+            self.unavailable_match_ids.add(match_id)
+            return None
+        if match is None:
+            return FETCH_FAILED
+        info = match["info"]
+        player = next((p for p in info["participants"] if p["puuid"] == puuid), None)
+        if player is None:
+            self.unavailable_match_ids.add(match_id)
+            return None
+        return MatchParticipant(
+            match_id=match_id,
+            puuid=puuid,
+            queue_id=info["queueId"],
+            champion_id=player["championId"],
+            win=player["win"],
+            kills=player["kills"],
+            deaths=player["deaths"],
+            assists=player["assists"],
+            game_creation=info["gameCreation"],
+            game_duration=info["gameDuration"]
+        )
+
+    async def ingest(self, account: Account):
+        if not account.puuid:
+            account.puuid = await self.riot.get_puuid(account.name, account.tag, account.platform)
+            if not account.puuid:
+                return 0
+            account.save()
+
+        # Newest first
+        match_ids = await self._get_new_match_ids(account)
+        if match_ids is None:
+            log.warning(f"Failed to list matches for {account.full_name()}, retrying next run", upstream="riot")
+            return 0
+        if not match_ids:
+            return 0
+
+        results = await asyncio.gather(*(self._fetch_participant(match_id, account) for match_id in match_ids))
+
+        # Only store matches older than the oldest failed fetch, otherwise the next run
+        # would start after the gap and never pick the failed match up again.
+        # Matches that can never be stored are skipped instead, they would block ingestion forever
+        failed = [i for i, result in enumerate(results) if result is FETCH_FAILED]
+        if failed:
+            results = results[failed[-1] + 1:]
+        results = [result for result in results if result is not None]
+        if not results:
+            return 0
+
+        await asyncio.to_thread(lambda: Database().create_match_participants(results))
+        log.info(f"Stored {len(results)} new matches for {account.full_name()}")
+        return len(results)
+
+    async def ingest_forever(self):
+        while True:
+            # Matches played while offline are picked up on the next run after going live
+            channels = await self.stream_status.wait_for_online_channels()
+            by_region = defaultdict(list)
+            for account in self.db.get_accounts_by_channels(channels):
+                by_region[self.riot.region_host(account.platform).name].append(account)
+            # Regions are ingested in parallel, accounts within a region one after another
+            await asyncio.gather(*(self._ingest_all(accounts) for accounts in by_region.values()))
+            await asyncio.sleep(INGEST_INTERVAL)
+
+    async def _ingest_all(self, accounts: list[Account]):
+        for account in accounts:
+            try:
+                await self.ingest(account)
+            except Exception as e:
+                log.error(f"Error ingesting {account.full_name()}: {e}", upstream="riot")
+
+    def _puuids(self, accounts: list[Account]):
+        return [account.puuid for account in accounts if account.puuid]
+
+    def winrate(self, accounts: list[Account]):
+        stats = self.db.get_champion_stats(self._puuids(accounts), SOLO_QUEUE_ID, season_of(time.time()))
+        games = sum(s.games for s in stats)
+        if games == 0:
+            return "No ranked games found"
+        wins = sum(s.wins for s in stats)
+        return f"{wins}W {games - wins}L ({round(wins / games * 100)}% winrate) in solo queue this season"
+
+    def champion_stats(self, accounts: list[Account], champion_json: dict, champion_name: str | None):
+        champion_id = None
+        if champion_name:
+            normalized = champion_name.lower().replace(" ", "").replace("'", "")
+            champion_id = next(
+                (id for id, champion in champion_json.items()
+                 if champion["name"].lower().replace(" ", "").replace("'", "") == normalized),
+                None
+            )
+            if champion_id is None:
+                return f"Unknown champion '{champion_name}'"
+
+        stats = self.db.get_champion_stats(self._puuids(accounts), SOLO_QUEUE_ID, season_of(time.time()), champion_id)
+        if not stats:
+            return "No ranked games found"
+
+        formatted = []
+        for s in stats[:3]:
+            kda = (s.kills + s.assists) / max(s.deaths, 1)
+            formatted.append(f"{champion_json[s.champion_id]['name']}: {s.games} games, {round(s.wins / s.games * 100)}% WR, {kda:.2f} KDA")
+        return " | ".join(formatted)
+
+    def last_game(self, accounts: list[Account], champion_json: dict):
+        game = self.db.get_latest_match_participant(self._puuids(accounts))
+        if game is None:
+            return "No games found"
+        result = "Won" if game.win else "Lost"
+        minutes_ago = round((time.time() - (game.game_creation / 1000 + game.game_duration)) / 60)
+        return f"{result} as {champion_json[game.champion_id]['name']} {game.kills}/{game.deaths}/{game.assists} ({minutes_ago} minutes ago)"
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+from log import get_logger
+
+log = get_logger("Profiler")
+
+PROFILE_DIR = "profiles"
+SAMPLE_INTERVAL = 0.005
+MAX_DURATION = 60 * 5
+TOP_N = 15
+
+_NULL_SPAN = nullcontext()
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    total: float = 0
+    max: float = 0
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "started_at")
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record_span(self.name, time.perf_counter() - self.started_at)
+        return False
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.spans: dict[str, SpanStats] = {}
+        self.samples: Counter = Counter()
+
+    def span(self, name: str):
+        """Time a block while profiling, usable around awaits. Costs one attribute check when disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def _record_span(self, name: str, elapsed: float):
+        stats = self.spans.get(name)
+        if stats is None:
+            stats = self.spans[name] = SpanStats()
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+
+    def _sample_loop(self, thread_id: int, stop: threading.Event):
+        # Wall-clock stack sampling of the event loop thread, idle time shows up as the selector
+        while not stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    async def run(self, duration: float):
+        """Profile the running process for duration seconds and return the paths written"""
+        if self.enabled:
+            raise RuntimeError("Already profiling")
+        duration = min(duration, MAX_DURATION)
+        self.spans = {}
+        self.samples = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_loop, args=(threading.get_ident(), stop), daemon=True)
+
+        log.info("Profiling started", duration_s=duration)
+        self.enabled = True
+        sampler.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.enabled = False
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+
+        return await asyncio.to_thread(self._write, duration)
+
+    def top_spans(self, n: int = TOP_N):
+        return sorted(self.spans.items(), key=lambda item: item[1].total, reverse=True)[:n]
+
+    def _write(self, duration: float):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, time.strftime("profile-%Y%m%d-%H%M%S"))
+
+        # Folded stacks, loadable by flamegraph.pl and speedscope
+        folded_path = f"{base}.folded"
+        with open(folded_path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        total_samples = sum(self.samples.values())
+        self_samples = Counter()
+        for stack, count in self.samples.items():
+            self_samples[stack.rsplit(";", 1)[-1]] += count
+
+        summary_path = f"{base}.txt"
+        with open(summary_path, "w") as f:
+            f.write(f"Profiled {duration:.0f}s, {total_samples} samples\n\n")
+            f.write(f"Top {TOP_N} spans by total time\n")
+            f.write(f"{'span':<50} {'count':>8} {'total ms':>10} {'avg ms':>10} {'max ms':>10}\n")
+            for name, stats in self.top_spans():
+                f.write(f"{name:<50} {stats.count:>8} {stats.total * 1000:>10.1f} {stats.total / stats.count * 1000:>10.2f} {stats.max * 1000:>10.1f}\n")
+            f.write(f"\nTop {TOP_N} functions by self samples\n")
+            for label, count in self_samples.most_common(TOP_N):
+                f.write(f"{label:<80} {count:>8} {count / max(total_samples, 1) * 100:>6.1f}%\n")
+
+        log.info("Profiling finished", folded=folded_path, summary=summary_path, samples=total_samples)
+        return folded_path, summary_path
+
+
+# Shared by every module so spans can be added without passing the profiler around
+profiler = Profiler()
@@ -0,0 +1,52 @@
+import asyncio
+import bisect
+import time
+from collections import deque
+
+# Development key limits: 20 requests every second, 100 requests every 2 minutes
+DEFAULT_RIOT_RATE_LIMITS = "20:1,100:120"
+
+
+def parse_rate_limits(value: str):
+    """Parse "count:seconds,count:seconds" into [(count, seconds), ...]"""
+    limits = []
+    for part in value.split(","):
+        count, seconds = part.strip().split(":")
+        limits.append((int(count), float(seconds)))
+    return limits
+
+
+class RateLimiter:
+    def __init__(self, limits: list[tuple[int, float]]):
+        self.limits = limits
+        self.longest_window = max(window for _, window in limits)
+        self.history = deque()
+        self.paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def _wait_time(self, now: float):
+        while self.history and self.history[0] <= now - self.longest_window:
+            self.history.popleft()
+        wait = self.paused_until - now
+        for count, window in self.limits:
+            # Timestamps are sorted, so the requests inside the window are a suffix
+            inside = len(self.history) - bisect.bisect_right(self.history, now - window)
+            if inside >= count:
+                oldest_in_window = self.history[len(self.history) - count]
+                wait = max(wait, oldest_in_window + window - now)
+        return wait
+
+    async def acquire(self):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now)
+                if wait <= 0:
+                    self.history.append(now)
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Block the bucket for the given time, used when the server answers with 429"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
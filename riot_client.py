@@ -1,106 +1,170 @@
 import os
+import time
+import aiohttp
 
+from rate_limiter import RateLimiter, parse_rate_limits, DEFAULT_RIOT_RATE_LIMITS
 from champion_cache import ChampionCache
 from rune_cache import RuneCache
 from db import Account
+from log import get_logger
+from profiler import profiler
+
+log = get_logger("Riot")
+
+APEX_TIERS = ["MASTER", "GRANDMASTER", "CHALLENGER"]
+DEFAULT_PLATFORM = "euw1"
+CONNECTIONS_PER_HOST = 10
+DNS_CACHE_TTL = 60 * 10
+# Platform routing value -> regional routing value used by account-v1 and match-v5
+PLATFORM_REGIONS = {
+    "euw1": "europe", "eun1": "europe", "tr1": "europe", "ru": "europe", "me1": "europe",
+    "na1": "americas", "br1": "americas", "la1": "americas", "la2": "americas",
+    "kr": "asia", "jp1": "asia",
+    "oc1": "sea", "sg2": "sea", "tw2": "sea", "vn2": "sea",
+}
+
+
+# account-v1 is not served from sea, those platforms look up Riot IDs through asia
+ACCOUNT_REGIONS = {"sea": "asia"}
+
+
+def region_for(platform: str):
+    return PLATFORM_REGIONS.get(platform.lower(), os.getenv("RIOT_REGION", "europe"))
+
+
+def format_rank(tier: str, rank: str, league_points: int):
+    # Apex tiers don't have divisions
+    if tier in APEX_TIERS:
+        return f"{tier.capitalize()} {league_points}LP"
+    return f"{tier.capitalize()} {rank} {league_points}LP"
+
+class RiotHost:
+    """One Riot API host with its own connection pool and rate limit bucket"""
+    def __init__(self, name: str, headers: dict, rate_limits: list[tuple[int, float]]):
+        self.name = name
+        self.base_url = f"https://{name}.api.riotgames.com"
+        self.headers = headers
+        self.rate_limits = rate_limits
+        self.rate_limiter = RateLimiter(rate_limits)
+        self.session = None
+
+    def _session(self):
+        # Created lazily, sessions have to be made inside the running event loop
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=CONNECTIONS_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+            self.session = aiohttp.ClientSession(base_url=self.base_url, headers=self.headers, connector=connector)
+        return self.session
+
+    async def get_json(self, path, params=None):
+        _, data = await self.request(path, params)
+        return data
+
+    async def request(self, path, params=None):
+        """Returns (status, json), json is None for anything but a 200"""
+        await self.rate_limiter.acquire()
+        started_at = time.perf_counter()
+        with profiler.span("riot"):
+            async with self._session().get(path, params=params) as resp:
+                log.debug("Request finished", upstream="riot", host=self.name, path=resp.url.path, status=resp.status,
+                          latency_ms=round((time.perf_counter() - started_at) * 1000), sample_rate=0.1)
+                if resp.status == 200:
+                    return resp.status, await resp.json()
+                if resp.status == 429:
+                    retry_after = int(resp.headers.get("Retry-After", 1))
+                    log.warning(f"Rate limited, pausing requests for {retry_after}s", upstream="riot", host=self.name)
+                    self.rate_limiter.pause(retry_after)
+                return resp.status, None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
 
 class RiotClient:
     def __init__(self, session):
+        # Only used for the static data caches, Riot API requests go through the per-host sessions
         self.session = session
         self.headers = {"X-Riot-Token": os.getenv("RIOT_API_KEY")}
         self.rune_cache = RuneCache()
         self.champion_cache = ChampionCache()
-
-    async def get_puuid(self, name, tag):
-        url = f"https://{os.getenv('RIOT_REGION')}.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{name}/{tag}"
-        async with self.session.get(url, headers=self.headers) as resp:
-            if resp.status == 200:
-                return (await resp.json())["puuid"]
-        return None
-
-    async def get_current_match(self, puuid):
-        url = f"https://{os.getenv('RIOT_PLATFORM')}.api.riotgames.com/lol/spectator/v5/active-games/by-summoner/{puuid}"
-        async with self.session.get(url, headers=self.headers) as resp:
-            if resp.status == 200:
-                return await resp.json()
+        self.rate_limits = parse_rate_limits(os.getenv("RIOT_RATE_LIMITS", DEFAULT_RIOT_RATE_LIMITS))
+        self.default_platform = os.getenv("RIOT_PLATFORM", DEFAULT_PLATFORM).lower().strip()
+        # host name -> host, each platform and regional host is limited separately by Riot
+        self.hosts: dict[str, RiotHost] = {}
+
+    def _host(self, name: str):
+        if name not in self.hosts:
+            self.hosts[name] = RiotHost(name, self.headers, self.rate_limits)
+        return self.hosts[name]
+
+    def platform_host(self, platform: str | None = None):
+        return self._host(platform or self.default_platform)
+
+    def region_host(self, platform: str | None = None):
+        return self._host(region_for(platform or self.default_platform))
+
+    def account_host(self, platform: str | None = None):
+        region = region_for(platform or self.default_platform)
+        return self._host(ACCOUNT_REGIONS.get(region, region))
+
+    async def close(self):
+        for host in self.hosts.values():
+            await host.close()
+
+    async def get_puuid(self, name, tag, platform: str | None = None):
+        # Riot IDs are global, the closest region that serves account-v1 answers
+        data = await self.account_host(platform).get_json(f"/riot/account/v1/accounts/by-riot-id/{name}/{tag}")
+        if data is not None:
+            return data["puuid"]
         return None
 
-    async def get_rune_names_from_match(self, match_data, puuid):
-        player = next((p for p in match_data["participants"] if p["puuid"] == puuid), None)
-        if not player:
-            return []
+    async def get_current_match(self, puuid, platform: str | None = None):
+        """Returns (status, match), a 404 means the player is not in game"""
+        return await self.platform_host(platform).request(f"/lol/spectator/v5/active-games/by-summoner/{puuid}")
 
-        ids = player["perks"]["perkIds"]
+    async def get_match_ids(self, puuid, start_time: int | None = None, start: int = 0, count: int = 100,
+                            platform: str | None = None):
+        params = {"start": start, "count": count}
+        if start_time is not None:
+            params["startTime"] = start_time
+        return await self.region_host(platform).get_json(f"/lol/match/v5/matches/by-puuid/{puuid}/ids", params)
 
-        runes_json = await self.rune_cache.get(self.session)
-        names = []
+    async def get_match(self, match_id):
+        """Returns (status, match) so callers can tell a missing match from a failed request"""
+        # Match ids start with the platform they were played on, e.g. EUW1_1234567890
+        platform = match_id.split("_", 1)[0].lower() if "_" in match_id else None
+        return await self.region_host(platform).request(f"/lol/match/v5/matches/{match_id}")
 
-        for rune_id in ids:
-            names.append(runes_json[rune_id]["name"])
+    async def get_summoner_data(self, puuid: str, platform: str | None = None):
+        return await self.platform_host(platform).get_json(f"/lol/league/v4/entries/by-puuid/{puuid}")
 
-        return names
+    async def get_apex_league(self, tier: str, platform: str | None = None):
+        # tier is challenger, grandmaster or master
+        return await self.platform_host(platform).get_json(f"/lol/league/v4/{tier}leagues/by-queue/RANKED_SOLO_5x5")
 
-    async def get_runes_for(self, account: Account):
-        # PUUID does not change, we can cache it
+    async def get_solo_queue_entry(self, account: Account):
         if not account.puuid:
-            account.puuid = await self.get_puuid(account.name, account.tag)
+            account.puuid = await self.get_puuid(account.name, account.tag, account.platform)
             if not account.puuid:
-                return "Could not find summoner."
+                return None
             account.save()
 
-        match = await self.get_current_match(account.puuid)
-        if not match:
-            return None
-
-        runes = await self.get_rune_names_from_match(match, account.puuid)
-        if not runes:
-            print(f"[Riot] Could not find rune data for {account.name}.")
+        data = await self.get_summoner_data(account.puuid, account.platform)
+        if data is None:
             return None
-
-        return ', '.join(runes)
-
-    async def get_summoner_data(self, puuid: str):
-        url = f"https://{os.getenv('RIOT_PLATFORM')}.api.riotgames.com/lol/league/v4/entries/by-puuid/{puuid}"
-
-        async with self.session.get(url, headers=self.headers) as resp:
-            if resp.status == 200:
-                return await resp.json()
-        return None
+        return next((league for league in data if league['queueType'] == "RANKED_SOLO_5x5"), None)
 
     async def get_rank_for(self, account: Account):
         if not account.puuid:
-            account.puuid = await self.get_puuid(account.name, account.tag)
+            account.puuid = await self.get_puuid(account.name, account.tag, account.platform)
             if not account.puuid:
                 return "Could not find summoner."
             account.save()
 
-        data = await self.get_summoner_data(account.puuid)
+        data = await self.get_summoner_data(account.puuid, account.platform)
         if data is None:
             return "Error"
         for league in data:
             if league['queueType'] == "RANKED_SOLO_5x5":
-                # Handle master
-                if league['tier'] == 'MASTER' or league['tier'] == "GRANDMASTER" or league['tier'] == 'CHALLENGER':
-                    return [f"{league['tier'].capitalize()} {league['leaguePoints']}LP", league['leaguePoints']]
-                else:
-                    return [f"{league['tier'].capitalize()} {league['rank']} {league['leaguePoints']}LP", league['leaguePoints']]
-
-    async def get_champion_for(self, account: Account) -> str | None:
-        if not account.puuid:
-            account.puuid = await self.get_puuid(account.name, account.tag)
-            if not account.puuid:
-                return "Could not find summoner."
-            account.save()
-
-        match = await self.get_current_match(account.puuid)
-        if not match:
-            return None
-        
-        player = next((p for p in match["participants"] if p["puuid"] == account.puuid), None)
-        if not player:
-            return None
-
-        champion_id = player["championId"]
-        champion_json = await self.champion_cache.get(self.session)
-        champion_name = champion_json[champion_id]["name"]
-        return champion_name
+                return [format_rank(league['tier'], league['rank'], league['leaguePoints']), league['leaguePoints']]
@@ -1,4 +1,7 @@
 import time
+from log import get_logger
+
+log = get_logger("RuneCache")
 
 CACHE_DURATION = 60 * 60 * 24 * 7 # 1 week, this will basically never change for this use case
 
@@ -13,7 +16,7 @@ class RuneCache:
         if self.data and (now - self.last_fetched < CACHE_DURATION):
             return self.data
 
-        print("[RuneCache] Refreshing rune data...")
+        log.info("Refreshing rune data...")
         url = "https://raw.communitydragon.org/latest/plugins/rcp-be-lol-game-data/global/default/v1/perks.json"
         async with session.get(url) as resp:
             if resp.status == 200:
@@ -23,5 +26,16 @@ class RuneCache:
                 for obj in self.raw_data:
                     self.data[obj["id"]] = obj
             else:
-                print(f"[RuneCache] Failed to fetch: {resp.status}")
-        return self.data
\ No newline at end of file
+                log.warning("Failed to fetch", upstream="communitydragon", status=resp.status)
+        return self.data
+
+    def snapshot(self):
+        if not self.data:
+            return None
+        return {"raw_data": self.raw_data, "last_fetched": self.last_fetched}
+
+    def restore(self, snapshot: dict):
+        # Rebuilt from the raw data, JSON would have turned the integer ids into strings
+        self.raw_data = snapshot["raw_data"]
+        self.last_fetched = snapshot["last_fetched"]
+        self.data = {obj["id"]: obj for obj in self.raw_data}
@@ -0,0 +1,65 @@
+import json
+import os
+import time
+
+from log import get_logger
+
+log = get_logger("StateSnapshot")
+
+# Bump whenever the shape of an entry changes, snapshots from other versions are ignored
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILE = "state_snapshot.json"
+
+
+class StateSnapshot:
+    """
+    In-memory state written on shutdown and read back on the next start. Every entry carries the
+    time it was saved so the reader can decide per entry how old is too old.
+    """
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+
+    def put(self, name: str, data):
+        if data is not None:
+            self.entries[name] = {"saved_at": time.time(), "data": data}
+
+    def get(self, name: str, max_age: float):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        age = time.time() - entry["saved_at"]
+        if age > max_age:
+            log.info("Ignoring stale snapshot entry", entry=name, age_s=round(age))
+            return None
+        return entry["data"]
+
+    def save(self):
+        # Written to a temporary file first so a crash mid-write can't leave a truncated snapshot
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"version": SNAPSHOT_VERSION, "entries": self.entries}, f)
+            os.replace(temp_path, self.path)
+            log.info("Wrote snapshot", entries=len(self.entries))
+        except (OSError, TypeError, ValueError) as e:
+            log.error(f"Failed to write snapshot: {e}")
+
+    def load(self):
+        """Read the snapshot and delete it, so a crash later on never restores the same state twice"""
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != SNAPSHOT_VERSION:
+                log.warning("Ignoring snapshot from another version", version=snapshot.get("version"))
+            else:
+                self.entries = snapshot["entries"]
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            log.warning(f"Ignoring unreadable snapshot: {e}")
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        return self
@@ -0,0 +1,72 @@
+import asyncio
+import os
+from log import get_logger
+
+log = get_logger("StreamStatus")
+
+# Point TWITCH_HELIX_URL at a local stub server for testing
+DEFAULT_HELIX_URL = "https://api.twitch.tv/helix"
+POLL_INTERVAL = 60
+
+
+class StreamStatus:
+    def __init__(self, session, channels: list[str]):
+        self.session = session
+        self.channels = channels
+        self.base_url = os.getenv("TWITCH_HELIX_URL", DEFAULT_HELIX_URL).rstrip("/")
+        self.client_id = os.getenv("TWITCH_CLIENT_ID")
+        # The IRC token works for Helix too as long as it belongs to the same client id
+        self.token = os.getenv("TWITCH_HELIX_TOKEN") or os.getenv("TWITCH_TOKEN", "").removeprefix("oauth:")
+        # Without Helix credentials every channel is treated as live, so nothing is ever suspended
+        self.enabled = bool(self.client_id and self.token)
+        # channel -> live or not, channels that were never polled successfully count as live
+        self.online: dict[str, bool] = {}
+        self._changed = asyncio.Condition()
+
+    def _login(self, channel: str):
+        return channel.lower().strip().removeprefix("#")
+
+    def is_online(self, channel: str):
+        if not self.enabled:
+            return True
+        return self.online.get(self._login(channel), True)
+
+    def online_channels(self):
+        return [channel for channel in self.channels if self.is_online(channel)]
+
+    async def wait_for_online_channels(self):
+        """Block until at least one channel is live and return the live channels"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: len(self.online_channels()) > 0)
+        return self.online_channels()
+
+    async def poll(self):
+        # One batched request for every joined channel
+        params = [("user_login", self._login(channel)) for channel in self.channels]
+        headers = {"Client-Id": self.client_id, "Authorization": f"Bearer {self.token}"}
+        async with self.session.get(f"{self.base_url}/streams", params=params, headers=headers) as resp:
+            if resp.status != 200:
+                log.warning("Failed to fetch stream status, keeping last known state", upstream="helix", status=resp.status)
+                return
+            data = (await resp.json())["data"]
+
+        live = {stream["user_login"].lower() for stream in data if stream.get("type") == "live"}
+        async with self._changed:
+            for channel in self.channels:
+                login = self._login(channel)
+                is_live = login in live
+                if self.online.get(login) != is_live:
+                    log.info("Stream went live" if is_live else "Stream went offline", channel=channel)
+                self.online[login] = is_live
+            self._changed.notify_all()
+
+    async def poll_forever(self):
+        if not self.enabled:
+            log.info("No Twitch client id configured, background jobs always run")
+            return
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                log.error(f"Error while polling stream status: {e}", upstream="helix")
+            await asyncio.sleep(POLL_INTERVAL)
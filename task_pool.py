@@ -0,0 +1,80 @@
+import asyncio
+from collections import defaultdict
+
+from log import get_logger
+
+log = get_logger("TaskPool")
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 20
+# Tasks per name that may be running or waiting for a slot before new ones are dropped
+DEFAULT_MAX_PENDING = 16
+DRAIN_TIMEOUT = 10
+
+
+class TaskPool:
+    """Runs spawned handlers with per-name concurrency caps, deadlines and load shedding"""
+    def __init__(self, concurrency: dict[str, int] | None = None, timeouts: dict[str, float] | None = None,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        self.concurrency = concurrency or {}
+        self.timeouts = timeouts or {}
+        self.max_pending = max_pending
+        self.tasks: set[asyncio.Task] = set()
+        self.pending: dict[str, int] = defaultdict(int)
+        self.closed = False
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, name: str):
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.concurrency.get(name, DEFAULT_CONCURRENCY))
+        return self._semaphores[name]
+
+    def submit(self, name: str, coroutine):
+        """Schedule coroutine under name, returns the task or None if it was dropped"""
+        if self.closed or self.pending[name] >= self.max_pending:
+            # Close it so Python doesn't warn about a coroutine that was never awaited
+            coroutine.close()
+            log.warning("Dropped task, pool is full" if not self.closed else "Dropped task, pool is closed",
+                        task=name, pending=self.pending[name], sample_rate=0.1)
+            return None
+        self.pending[name] += 1
+        task = asyncio.create_task(self._run(name, coroutine))
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    async def _run(self, name: str, coroutine):
+        timeout = self.timeouts.get(name, DEFAULT_TIMEOUT)
+        try:
+            # The deadline covers waiting for a slot too, so a backed up queue can't hold tasks forever
+            await asyncio.wait_for(self._run_with_slot(name, coroutine), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Task timed out", task=name, timeout_s=timeout)
+        finally:
+            self.pending[name] -= 1
+
+    async def _run_with_slot(self, name: str, coroutine):
+        try:
+            async with self._semaphore(name):
+                await coroutine
+        finally:
+            # No-op if it ran, stops the never awaited warning if it timed out while waiting
+            coroutine.close()
+
+    def _done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Task failed: {task.exception()}", exc_info=task.exception())
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """Stop accepting tasks, wait for running ones and cancel whatever is left after timeout"""
+        self.closed = True
+        if not self.tasks:
+            return
+        log.info("Draining tasks", count=len(self.tasks))
+        _, still_running = await asyncio.wait(set(self.tasks), timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            log.warning("Cancelled tasks that did not finish in time", count=len(still_running))
+            await asyncio.wait(still_running)
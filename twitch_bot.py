@@ -1,20 +1,76 @@
 import os
 import random
+import signal
 import ssl
 import aiohttp
 import asyncio
 import time
 import re
-from riot_client import RiotClient
+from riot_client import RiotClient, PLATFORM_REGIONS
 from lolpros_api import LolprosApi
 from deeplol_api import DeepLolApi
+from cutoff_service import CutoffService
+from ladder import LadderMirror, MAX_STALENESS as LADDER_MAX_STALENESS
+from lp_history import LpHistory
+from match_history import MatchHistory
+from stream_status import StreamStatus
+from usage_stats import UsageStats
+from coalescer import ResponseCoalescer
+from live_game import LiveGameTracker, SNAPSHOT_MAX_AGE as LIVE_GAME_SNAPSHOT_MAX_AGE
+from task_pool import TaskPool
+from chat_archive import ChatArchive
+from state_snapshot import StateSnapshot
+from champion_cache import CACHE_DURATION as CHAMPION_CACHE_DURATION
+from rune_cache import CACHE_DURATION as RUNE_CACHE_DURATION
 from db import Database, Account, Command
+from log import get_logger
+from profiler import profiler
+
+log = get_logger("Bot")
 
 ADMIN_USERS = ["reptile9lol", "gcorebyte", "k1mbo9lol"]
 
 NOT_IN_GAME = "Reptile is currently not in game"
 SCRIMS = "reptile is currently in scrims, some commands are currently disabled"
 COOLDOWN_TIME = 3
+# Built-in commands that are counted in the usage stats, keyword commands are counted by name
+BUILTIN_COMMANDS = ["!runes", "!pros", "!champ", "!rank", "!cutoff", "!ladder", "!lp", "!peak", "!winrate", "!champstats", "!lastgame", "!wiki"]
+# Seconds to collect identical requests before answering them all in one message, 0 disables it
+COALESCE_WINDOWS = {
+    "!rank": 2,
+    "!cutoff": 2,
+    "!ladder": 2,
+    "!lp": 2,
+    "!peak": 2,
+    "!winrate": 2,
+    "!champstats": 2,
+    "!lastgame": 2,
+}
+# Concurrent handlers per command, anything not listed gets task_pool.DEFAULT_CONCURRENCY
+COMMAND_CONCURRENCY = {
+    "!rank": 2,
+    "!pros": 1,
+    "!profile": 1,
+}
+# Seconds before a handler is cancelled, anything not listed gets task_pool.DEFAULT_TIMEOUT
+COMMAND_TIMEOUTS = {
+    "!pros": 60,
+    "!profile": 60 * 6,
+}
+# Twitch messages are capped at 500 characters
+MAX_MENTIONS = 8
+RECONNECT_BACKOFF_BASE = 1
+RECONNECT_BACKOFF_MAX = 60
+# Twitch pings every ~5 minutes, if nothing arrives for longer we ping ourselves
+IDLE_TIMEOUT = 60 * 6
+# A connection that doesn't answer our ping within this time is considered dead
+PONG_TIMEOUT = 15
+# Seconds a new connection gets to log in and join every channel before a reconnect is abandoned
+HANDSHAKE_TIMEOUT = 15
+# Seconds to wait for queued outgoing messages to reach Twitch on shutdown
+SEND_DRAIN_TIMEOUT = 5
+# quiet and scrims survive a restart unless the bot was down for longer than this
+FLAGS_SNAPSHOT_MAX_AGE = 60 * 60 * 12
 
 def is_admin(user: str):
     # This should probably check if the user is a mod too
@@ -28,14 +84,30 @@ class TwitchBot:
         self.riot = None
         self.lolpros = None
         self.deeplol = None
+        self.cutoffs = None
+        self.ladder = None
+        self.lp_history = None
+        self.match_history = None
+        self.stream_status = None
+        self.live_games = None
+        self.background_tasks = []
         self.db = Database()
+        self.usage = UsageStats()
+        self.archive = ChatArchive()
+        self.tasks = TaskPool(COMMAND_CONCURRENCY, COMMAND_TIMEOUTS)
+        self.coalescer = ResponseCoalescer(self.send_to_many, self.tasks.submit)
         self.count = 1
         self.previous_message = ""
         self.last_message_sent_at = 0  # Initialize to 0 to allow first message
         self.quiet = False
         self.scrims = False
+        self.channels = [os.getenv("TWITCH_CHANNEL"), "#gcorebyte"]
+        self.reconnect_attempt = 0
+        self.stopping = False
+        self._supervisor = None
+        self._reconnect_task = None
 
-    async def connect(self):
+    async def _open_connection(self):
         # https://docs.python.org/3/library/ssl.html#ssl-security
         ssl_context = ssl.create_default_context()
         reader, writer = await asyncio.open_connection(
@@ -43,21 +115,217 @@ class TwitchBot:
             int(os.getenv("TWITCH_PORT")),
             ssl=ssl_context
         )
-        self.reader = reader
-        self.writer = writer
-
-        self._send(f"PASS {os.getenv('TWITCH_TOKEN')}")
-        self._send(f"NICK {os.getenv('TWITCH_NICK')}")
-        self._send(f"JOIN {os.getenv('TWITCH_CHANNEL')}")
-        self._send(f"JOIN #gcorebyte")
-        # self._send(f"CAP REQ :twitch.tv/tags")
-        print("[Bot] Connected to Twitch")
-
-    def _send(self, message, log=True):
-        if log:
+
+        self._send(f"PASS {os.getenv('TWITCH_TOKEN')}", log_message=False, writer=writer)
+        self._send(f"NICK {os.getenv('TWITCH_NICK')}", writer=writer)
+        for channel in self.channels:
+            self._send(f"JOIN {channel}", writer=writer)
+        # self._send(f"CAP REQ :twitch.tv/tags", writer=writer)
+        return reader, writer
+
+    async def connect(self):
+        self.reader, self.writer = await self._open_connection()
+        log.info("Connected to Twitch")
+
+    async def reconnect(self):
+        """Open a new connection before closing the old one so no messages are lost in between"""
+        reader, writer = await self._open_connection()
+        ready = False
+        try:
+            await asyncio.wait_for(self._await_ready(reader, writer), HANDSHAKE_TIMEOUT)
+            ready = True
+        except asyncio.TimeoutError:
+            raise ConnectionError("Twitch did not confirm the login and joins in time")
+        finally:
+            if not ready:
+                # Login failed or took too long, the old connection keeps working
+                await self._close_writer(writer)
+        old_writer = self.writer
+        self.reader, self.writer = reader, writer
+        log.info("Reconnected to Twitch")
+        await self._close_writer(old_writer)
+
+    async def _await_ready(self, reader, writer):
+        """Read a new connection until Twitch accepted the login and confirmed every JOIN"""
+        pending = {channel.lower() for channel in self.channels if channel}
+        own_prefix = f":{(os.getenv('TWITCH_NICK') or '').lower()}!"
+        welcomed = False
+        while not welcomed or pending:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Twitch closed the new connection during login")
+            decoded = line.decode().strip()
+            if decoded.startswith("PING"):
+                self._send("PONG :tmi.twitch.tv", log_message=False, writer=writer)
+            elif decoded.startswith(":tmi.twitch.tv 001"):
+                welcomed = True
+            elif decoded.startswith(":tmi.twitch.tv NOTICE") and "auth" in decoded.lower():
+                raise ConnectionError(f"Twitch rejected the login: {decoded}")
+            elif decoded.lower().startswith(own_prefix) and " JOIN " in decoded:
+                pending.discard(decoded.rsplit(" JOIN ", 1)[1].strip().lower())
+            # Chat seen here still arrives on the old connection, which is read until the swap
+
+    def _schedule_reconnect(self):
+        if self._reconnect_task is not None and not self._reconnect_task.done():
+            return
+        self._reconnect_task = asyncio.create_task(self.reconnect())
+        self._reconnect_task.add_done_callback(self._reconnect_done)
+
+    def _reconnect_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            # The old connection is still in use, the supervisor takes over if it dies too
+            log.error(f"Reconnect failed, keeping the current connection: {task.exception()}")
+
+    async def _close_writer(self, writer):
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (OSError, ssl.SSLError):
+            pass
+
+    def _backoff_delay(self):
+        # Exponential backoff with full jitter
+        ceiling = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** self.reconnect_attempt)
+        return random.uniform(0, ceiling)
+
+    async def run(self):
+        # The session and every client hanging off it live for the whole process,
+        # so caches survive reconnects
+        async with aiohttp.ClientSession() as session:
+            self.riot = RiotClient(session)
+            self.lolpros = LolprosApi(session)
+            self.deeplol = DeepLolApi(session)
+            self.stream_status = StreamStatus(session, self.channels)
+            self.cutoffs = CutoffService(self.deeplol, self.stream_status)
+            self.ladder = LadderMirror(self.riot, self.stream_status)
+            self.lp_history = LpHistory(self.riot, self.stream_status)
+            self.match_history = MatchHistory(self.riot, self.stream_status)
+            self.live_games = LiveGameTracker(self.riot, self.lolpros, self.stream_status)
+            self._restore_state(StateSnapshot().load())
+            self.background_tasks.append(asyncio.create_task(self.stream_status.poll_forever()))
+            self.background_tasks.append(asyncio.create_task(self.usage.flush_forever()))
+            self.background_tasks.append(asyncio.create_task(self.archive.flush_forever()))
+            self.background_tasks.append(asyncio.create_task(self.live_games.poll_forever()))
+            self.background_tasks.append(asyncio.create_task(self.cutoffs.prewarm_forever()))
+            self.background_tasks.append(asyncio.create_task(self.ladder.refresh_forever()))
+            self.background_tasks.append(asyncio.create_task(self.lp_history.sample_forever()))
+            self.background_tasks.append(asyncio.create_task(self.lp_history.flush_forever()))
+            self.background_tasks.append(asyncio.create_task(self.match_history.ingest_forever()))
+
+            loop = asyncio.get_running_loop()
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(signal_number, self.request_shutdown)
+                except (NotImplementedError, RuntimeError):
+                    # Not supported on Windows, Ctrl+C still stops the bot, just not gracefully
+                    pass
+
+            self._supervisor = asyncio.create_task(self._supervise_connection())
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                if not self.stopping:
+                    raise
+            finally:
+                await self.shutdown()
+
+    def request_shutdown(self):
+        if self.stopping:
+            return
+        log.info("Shutting down")
+        self.stopping = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+
+    async def shutdown(self):
+        """Finish in-flight work, flush everything pending and snapshot the in-memory state"""
+        # Handlers can still reply while they finish, so the connection stays open until they are done
+        await self.tasks.drain()
+        if self.writer is not None:
+            try:
+                await asyncio.wait_for(self.writer.drain(), SEND_DRAIN_TIMEOUT)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                log.warning(f"Could not send every queued message: {e}")
+            await self._close_writer(self.writer)
+            self.writer = None
+
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        for flush in (self.usage.flush, self.lp_history.flush, self.archive.close):
+            try:
+                await flush()
+            except Exception as e:
+                log.error(f"Error while flushing on shutdown: {e}")
+
+        self._snapshot_state().save()
+        await self.riot.close()
+
+    def _snapshot_state(self):
+        snapshot = StateSnapshot()
+        snapshot.put("flags", {"quiet": self.quiet, "scrims": self.scrims})
+        snapshot.put("cooldown", {"last_message_sent_at": self.last_message_sent_at})
+        snapshot.put("rune_cache", self.riot.rune_cache.snapshot())
+        snapshot.put("champion_cache", self.riot.champion_cache.snapshot())
+        snapshot.put("live_games", self.live_games.snapshot())
+        snapshot.put("ladder", self.ladder.snapshot())
+        return snapshot
+
+    def _restore_flags(self, data: dict):
+        self.quiet = data["quiet"]
+        self.scrims = data["scrims"]
+
+    def _restore_cooldown(self, data: dict):
+        self.last_message_sent_at = data["last_message_sent_at"]
+
+    def _restore_state(self, snapshot: StateSnapshot):
+        # Every entry has its own idea of how old is too old
+        restorers = [
+            ("flags", FLAGS_SNAPSHOT_MAX_AGE, self._restore_flags),
+            ("cooldown", COOLDOWN_TIME, self._restore_cooldown),
+            ("rune_cache", RUNE_CACHE_DURATION, self.riot.rune_cache.restore),
+            ("champion_cache", CHAMPION_CACHE_DURATION, self.riot.champion_cache.restore),
+            ("live_games", LIVE_GAME_SNAPSHOT_MAX_AGE, self.live_games.restore),
+            ("ladder", LADDER_MAX_STALENESS, self.ladder.restore),
+        ]
+        for name, max_age, restore in restorers:
+            data = snapshot.get(name, max_age)
+            if data is None:
+                continue
+            try:
+                restore(data)
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning(f"Ignoring snapshot entry {name}: {e}")
+
+    async def _supervise_connection(self):
+        while True:
+            try:
+                await self.connect()
+                await self.listen()
+                log.info("Connection closed by server")
+            except (OSError, ssl.SSLError, asyncio.IncompleteReadError) as e:
+                log.warning(f"Connection error: {e}")
+            await self._close_writer(self.writer)
+            self.reader = None
+            self.writer = None
+
+            delay = self._backoff_delay()
+            self.reconnect_attempt += 1
+            log.info(f"Reconnecting in {delay:.1f}s (attempt {self.reconnect_attempt})")
+            await asyncio.sleep(delay)
+
+    def _send(self, message, log_message=True, writer=None):
+        writer = writer or self.writer
+        if writer is None or writer.is_closing():
+            # Replies that finish while we are reconnecting have nowhere to go
+            log.debug("Dropped message, not connected", line=message if log_message else None)
+            return
+        if log_message:
             # Debugging purposes
-            print(f"[SEND] {message}")
-        self.writer.write(f"{message}\r\n".encode())
+            log.debug("Sent message", line=message)
+        writer.write(f"{message}\r\n".encode())
 
     def send(self, user, twitch_channel, message, reply_id = None):
         if reply_id:
@@ -65,41 +333,69 @@ class TwitchBot:
         else:
             self._send(f"PRIVMSG {twitch_channel} :@{user}, {message}")
 
+    def send_to_many(self, users, twitch_channel, message):
+        mentions = " ".join(f"@{user}" for user in users[:MAX_MENTIONS])
+        self._send(f"PRIVMSG {twitch_channel} :{mentions}, {message}")
+        self.last_message_sent_at = time.time()
+
     def send_without_mention(self, twitch_channel, message):
         self._send(f"PRIVMSG {twitch_channel} :{message}")
 
     async def listen(self):
-        #asyncio.create_task(self._periodic_cache_refresh())
-
-        async with aiohttp.ClientSession() as session:
-            print("[Bot] Running...")
-            self.riot = RiotClient(session)
-            self.lolpros = LolprosApi(session, self.riot, self)
-            self.deeplol = DeepLolApi(session)
-            
-            while True:
-                line = await self.reader.readline()
-                if not line:
-                    break
-
-                decoded = line.decode().strip()
-                # DEBUG
-                # print(f"[RECV] {decoded}")
+        log.info("Running...")
 
-                if decoded.startswith("PING"):
-                    self._send("PONG :tmi.twitch.tv", log=False)
-                elif "PRIVMSG" in decoded:
-                    await self.handle_command(decoded)
+        awaiting_pong = False
+        while True:
+            reader = self.reader
+            try:
+                # A half-open connection never returns anything, not even EOF
+                line = await asyncio.wait_for(reader.readline(), PONG_TIMEOUT if awaiting_pong else IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if reader is not self.reader:
+                    awaiting_pong = False
+                    continue
+                if awaiting_pong:
+                    raise ConnectionError("Twitch did not answer our PING")
+                self._send("PING :tmi.twitch.tv", log_message=False)
+                awaiting_pong = True
+                continue
+            except (OSError, ssl.SSLError):
+                if reader is not self.reader:
+                    continue
+                raise
+            if not line:
+                if reader is not self.reader:
+                    # The old connection was closed after a reconnect swapped it out
+                    continue
+                break
+            # Anything at all proves the connection is alive
+            awaiting_pong = False
+
+            decoded = line.decode().strip()
+
+            if decoded.startswith("PING"):
+                self._send("PONG :tmi.twitch.tv", log_message=False)
+            elif decoded.startswith(":tmi.twitch.tv 001"):
+                # Welcome message, authentication succeeded
+                self.reconnect_attempt = 0
+            elif decoded.startswith(":tmi.twitch.tv RECONNECT"):
+                log.info("Twitch requested a reconnect")
+                self._schedule_reconnect()
+            elif "PRIVMSG" in decoded:
+                # Only queued here, the archive writes in batches from its own task
+                self.archive.append(decoded)
+                try:
+                    with profiler.span("handle_command"):
+                        await self.handle_command(decoded)
+                except Exception as e:
+                    # A malformed command must never take the connection down with it
+                    log.exception(f"Error handling message: {e}", line=decoded)
 
     # I don't like how I handle this currently. This method is not extendable.
     # Probably best to add a self.commands = {} type object
     # Where the key is the string and the value is the function to run
     async def handle_command(self, message):
-        # Check rate limiting
         current_time = time.time()
-        if current_time - self.last_message_sent_at < COOLDOWN_TIME:
-            return  # Skip processing if less than 10 seconds have passed
-
         user = message.split("!", 1)[0][1:]
         content: str = message.split(":", 2)[2]
         if user.lower() == "nightbot" or user.lower() == "botile9lol":
@@ -111,30 +407,58 @@ class TwitchBot:
         normalized_content = content.lower()
         match = re.search(r'PRIVMSG\s+(#[^\s:]+)\s+:', message)
         channel = match.group(1).strip()
+        command_name = normalized_content.split(" ", 1)[0]
+
+        # Check rate limiting, requests that can still join an open coalescing window are let through
+        if current_time - self.last_message_sent_at < COOLDOWN_TIME and not self.coalescer.is_open(channel, normalized_content):
+            return  # Skip processing if less than 10 seconds have passed
 
         if self.quiet and (not normalized_content.startswith("!") or not is_admin(user)):
             return
-        # FIXME
+        if command_name in BUILTIN_COMMANDS:
+            self.usage.record(channel, command_name)
+        # In-game commands are answered from the live game snapshot
         if normalized_content.startswith("!runes"):
-            return
-            # if self.scrims:
-            #     self.send(user, channel, SCRIMS)
-            #     self.last_message_sent_at = current_time
-            #     return
-            # asyncio.create_task(self._handle_runes(user, channel))
-        # elif normalized_content.startswith("!pros"):
-        #     if self.scrims:
-        #         self.send(user, channel, SCRIMS)
-        #         self.last_message_sent_at = current_time
-        #         return
-        #     asyncio.create_task(self._handle_pros(user, channel))
+            if self.scrims:
+                self.send(user, channel, SCRIMS)
+                self.last_message_sent_at = current_time
+                return
+            self.send(user, channel, self.runes(channel))
+            self.last_message_sent_at = current_time
+        elif normalized_content.startswith("!pros"):
+            if self.scrims:
+                self.send(user, channel, SCRIMS)
+                self.last_message_sent_at = current_time
+                return
+            snapshot = self.live_games.current(channel)
+            if snapshot is not None and snapshot.pros_response is not None:
+                self.send(user, channel, snapshot.pros_response)
+                self.last_message_sent_at = current_time
+            else:
+                if snapshot is not None:
+                    self.send(user, channel, "Fetching data from Lolpros, this might take a bit...")
+                self.tasks.submit("!pros", self._handle_async(user, channel, "!pros", self.pros(channel)))
         elif normalized_content.startswith("!rank"):
-            asyncio.create_task(self._handle_rank(user, channel))
-        # elif normalized_content.startswith("!cutoff"):
-        #     # result = await self.cutoff()
-        #     result = "Currently disabled."
-        #     self.send(user, channel, result)
-        #     self.last_message_sent_at = current_time
+            self._handle_coalesced(user, channel, "!rank", normalized_content, lambda: self.rank(channel))
+        elif normalized_content.startswith("!cutoff"):
+            self._handle_coalesced(user, channel, "!cutoff", normalized_content, lambda: self.cutoff())
+        elif normalized_content.startswith("!ladder"):
+            self._handle_coalesced(user, channel, "!ladder", normalized_content, lambda: self.ladder_rank(channel))
+        elif normalized_content.startswith("!lp"):
+            # !lp and !lp today are answered from the local history, no API calls
+            self._handle_coalesced(user, channel, "!lp", normalized_content, lambda: self.lp_history.lp_today(self.db.get_accounts_by_channel(channel)))
+        elif normalized_content.startswith("!peak"):
+            self._handle_coalesced(user, channel, "!peak", normalized_content, lambda: self.lp_history.peak(self.db.get_accounts_by_channel(channel)))
+        elif normalized_content.startswith("!winrate"):
+            self._handle_coalesced(user, channel, "!winrate", normalized_content, lambda: self.match_history.winrate(self.db.get_accounts_by_channel(channel)))
+        elif normalized_content.startswith("!champstats"):
+            champion_name = content[len("!champstats"):].strip()
+            self._handle_coalesced(user, channel, "!champstats", normalized_content, lambda: self.champion_stats(channel, champion_name))
+        elif normalized_content.startswith("!champ"):
+            self.send(user, channel, self.champion(channel))
+            self.last_message_sent_at = current_time
+        elif normalized_content.startswith("!lastgame"):
+            self._handle_coalesced(user, channel, "!lastgame", normalized_content, lambda: self.last_game(channel))
         elif normalized_content.startswith("!wiki"):
             parts = normalized_content.removeprefix("!wiki ").split()
             result = f"https://wiki.leagueoflegends.com/en-us/{'_'.join(part.capitalize() for part in parts)}"
@@ -179,24 +503,50 @@ class TwitchBot:
                 self.send(user, channel, result)
                 self.last_message_sent_at = current_time
             elif normalized_content.startswith("!add"):
-                name, tag = normalized_content.removeprefix("!add ").split("#")
-                result = await self.add_account(name, tag)
+                # Format: !add name#tag [platform], e.g. !add hide on bush#kr1 kr
+                args = normalized_content.removeprefix("!add ").strip()
+                # Riot ids can contain spaces, the platform is only split off if it is a known one
+                riot_id, _, platform = args.rpartition(" ")
+                if platform not in PLATFORM_REGIONS:
+                    riot_id, platform = args, None
+                name, tag = riot_id.split("#")
+                result = await self.add_account(channel, name, tag, platform)
                 self.send(user, channel, result)
                 self.last_message_sent_at = current_time
             elif normalized_content.startswith("!delete"):
                 name, tag = normalized_content.removeprefix("!delete ").split("#")
-                result = await self.delete_account(name, tag)
+                result = await self.delete_account(channel, name, tag)
                 self.send(user, channel, result)
                 self.last_message_sent_at = current_time
             elif normalized_content.startswith("!accounts"):
-                result = await self.accounts()
+                result = await self.accounts(channel)
                 self.send(user, channel, result)
                 self.last_message_sent_at = current_time
 
             elif normalized_content.startswith("!restart"):
+                # Reconnect in-process so the HTTP session and caches stay warm
                 self.send(user, channel, "Restarting...")
                 self.last_message_sent_at = current_time
-                exit(0)
+                self._schedule_reconnect()
+            elif normalized_content.startswith("!shutdown"):
+                # Stops the process after saving its state, whatever supervises it starts it again warm
+                self.send(user, channel, "Shutting down...")
+                self.last_message_sent_at = current_time
+                self.request_shutdown()
+            elif normalized_content.startswith("!usage"):
+                # Format: !usage [hours], defaults to the last day
+                hours = normalized_content.removeprefix("!usage").strip()
+                hours = int(hours) if hours.isdigit() and int(hours) > 0 else 24
+                self.tasks.submit("!usage", self._handle_async(user, channel, "!usage", self.usage.top(channel, hours)))
+                self.last_message_sent_at = current_time
+            elif normalized_content.startswith("!profile"):
+                # Format: !profile 30s
+                duration = self._parse_duration(normalized_content.removeprefix("!profile").strip() or "30s")
+                if duration is None:
+                    self.send(user, channel, "Usage: !profile 30s")
+                else:
+                    self.tasks.submit("!profile", self._handle_async(user, channel, "!profile", self.profile(channel, duration)))
+                self.last_message_sent_at = current_time
             elif normalized_content.startswith("!s "):
                 self.send_without_mention(channel, content.removeprefix("!s "))
                 self.last_message_sent_at = current_time
@@ -217,8 +567,10 @@ class TwitchBot:
         else:
             # Check for keyword matches in command database when no commands have matched
             # First check for phrase matches (keywords with spaces) in the original content
-            matched_command = self.db.find_command_with_phrase_match(channel, content)
+            with profiler.span("db.find_command_with_phrase_match"):
+                matched_command = self.db.find_command_with_phrase_match(channel, content, self.usage.usage_for(channel))
             if matched_command:
+                self.usage.record(channel, matched_command.name)
                 self.send(user, channel, matched_command.message)
                 self.last_message_sent_at = current_time
             else:
@@ -226,8 +578,10 @@ class TwitchBot:
                 words = content.split()
                 if words:
                     # Find command with most matching keywords
-                    matched_command = self.db.find_command_with_most_matching_keywords(channel, words)
+                    with profiler.span("db.find_command_with_most_matching_keywords"):
+                        matched_command = self.db.find_command_with_most_matching_keywords(channel, words, self.usage.usage_for(channel))
                     if matched_command:
+                        self.usage.record(channel, matched_command.name)
                         self.send(user, channel, matched_command.message)
                         self.last_message_sent_at = current_time
             # Hack - join emote walls
@@ -242,139 +596,103 @@ class TwitchBot:
         if self.count == 4:
             self.send_without_mention(channel, self.previous_message)
 
-    # # Helper methods for non-blocking command execution
-    # async def _handle_runes(self, user: str, channel: str):
-    #     return
-    #     try:
-    #         # Riot broke it.
-    #         result = await self.runes()
-    #         self.send(user, channel, result)
-    #         self.last_message_sent_at = time.time()
-    #     except Exception as e:
-    #         print(f"[Bot] Error in _handle_runes: {e}")
-    #         self.send(user, channel, f"Error: {e}")
-
-    # async def _handle_pros(self, user: str, channel: str):
-    #     try:
-    #         result = await self.pros(user, channel)
-    #         if result is None:
-    #             result = NOT_IN_GAME
-    #         self.send(user, channel, result)
-    #         self.last_message_sent_at = time.time()
-    #     except Exception as e:
-    #         print(f"[Bot] Error in _handle_pros: {e}")
-    #         self.send(user, channel, f"Error: {e}")
-
-    async def _handle_rank(self, user: str, channel: str):
+    def _handle_coalesced(self, user: str, channel: str, command: str, key: str, compute):
+        """
+        Answer everyone who sends the same command within the command's window with one message.
+        The key is the full normalized message so different arguments are never merged.
+        """
+        window = COALESCE_WINDOWS.get(command, 0)
+        if window <= 0:
+            result = compute()
+            if asyncio.iscoroutine(result):
+                self.tasks.submit(command, self._handle_async(user, channel, command, result))
+            else:
+                self.send(user, channel, result)
+                self.last_message_sent_at = time.time()
+            return
+        self.coalescer.submit(channel, key, user, window, compute)
+
+    async def _handle_async(self, user: str, channel: str, command: str, coroutine):
+        started_at = time.perf_counter()
         try:
-            result = await self.rank()
+            with profiler.span(command):
+                result = await coroutine
             self.send(user, channel, result)
             self.last_message_sent_at = time.time()
+            log.info("Handled command", channel=channel, command=command,
+                     latency_ms=round((time.perf_counter() - started_at) * 1000))
         except Exception as e:
-            print(f"[Bot] Error in _handle_rank: {e}")
+            log.exception(f"Error in {command}: {e}", channel=channel, command=command)
             self.send(user, channel, f"Error: {e}")
 
-    # # Move to own module
-    # async def runes(self):
-    #     accounts = self.db.get_all_accounts()
-    #     if len(accounts) == 0:
-    #         return "No accounts configured"
-    #     for account in accounts:
-    #         try:
-    #             result = await self.riot.get_runes_for(account)
-    #             if result is not None:
-    #                 return result
-    #         except Exception as e:
-    #             # Something went really wrong, log it and also give the error in twitch chat
-    #             # Probably best to remove it from twitch chat later
-    #             print(f"[Bot] Error: {e}")
-    #             return f"erm what did u do: {e}"
-    #     return NOT_IN_GAME
-
     # # Move these to their own module and add them to self.commands
-    # async def add_account(self, name: str, tag: str):
-    #     account = self.db.get_account_by_name_and_tag(name, tag)
-    #     if account:
-    #         return f"Account {name}#{tag} already exists"
-    #     account = Account(name=name, tag=tag)
-    #     account.save()
-    #     return f"Added {name}#{tag} to the database"
-
-    # async def delete_account(self, name: str, tag: str):
-    #     account = self.db.get_account_by_name_and_tag(name, tag)
-    #     if account:
-    #         account.delete()
-    #         return f"Deleted {name}#{tag} from the database"
-    #     return f"Account {name}#{tag} not found"
-
-    # async def accounts(self):
-    #     accounts = self.db.get_all_accounts()
-    #     if len(accounts) == 0:
-    #         return "No accounts configured"
-    #     full_names = [account.full_name() for account in accounts]
-    #     return ", ".join(full_names)
-
-    # async def pros(self, user, channel):
-    #     account = await self._get_current_account()
-    #     if account is None:
-    #         return NOT_IN_GAME
-    #     result = await self.lolpros.get_all_pro_names(account, user, channel)
-    #     if result is not None:
-    #         return result
-    #     return 'something broke - pls ping core :3'
-
-    # async def _get_current_account(self) -> Account | None:
-    #     accounts = self.db.get_all_accounts()
-    #     if len(accounts) == 0:
-    #         return None
-    #     for acc in accounts:
-    #         try:
-    #             result = await self.riot.get_runes_for(acc)
-    #             if result is not None:
-    #                 return acc
-    #         except Exception as e:
-    #             print(f"[Bot] Error: {e}")
-    #             return None
-    #     return None
-
-    # async def refresh_caches(self):
-        """Check if any account is in game and refresh lolpros cache if so"""
-        # return
-        #account = await self._get_current_account()
-        #if account is None:
-        #    return
-        #data, cache_updated = await self.lolpros._get_lolpros_data(account, None, None)
-        #if cache_updated:
-        #    self.send_without_mention(os.getenv("TWITCH_CHANNEL"), await self.lolpros.get_all_pro_names(account, None, None))
-
-    # async def _periodic_cache_refresh(self):
-        """Run refresh_caches every minute"""
-        #return
-        #while True:
-        #    try:
-        #        print("[Bot] Refreshing caches...")
-        #        await self.refresh_caches()
-        #    except Exception as e:
-        #        print(f"[Bot] Error in periodic cache refresh: {e}")
-        #    
-        #    # Wait 60 seconds before next check
-        #    await asyncio.sleep(30)
-
-    async def rank(self):
-        accounts = self.db.get_all_accounts()
+    async def add_account(self, channel: str, name: str, tag: str, platform: str | None = None):
+        # Accounts can be shared between channels, reuse the existing row if there is one
+        account = self.db.get_account_by_name_and_tag(name, tag)
+        if account is None:
+            account = Account(name=name, tag=tag, platform=platform)
+        elif platform is not None:
+            account.platform = platform
+        account.save()
+        if not self.db.add_account_to_channel(account, channel):
+            return f"Account {name}#{tag} already exists"
+        return f"Added {name}#{tag} to the database"
+
+    async def delete_account(self, channel: str, name: str, tag: str):
+        account = self.db.get_account_by_name_and_tag(name, tag)
+        if account and self.db.remove_account_from_channel(account, channel):
+            # Only drop the account itself once no channel tracks it anymore
+            if self.db.get_channel_count_for_account(account) == 0:
+                account.delete()
+            return f"Deleted {name}#{tag} from the database"
+        return f"Account {name}#{tag} not found"
+
+    async def accounts(self, channel: str):
+        accounts = self.db.get_accounts_by_channel(channel)
+        if len(accounts) == 0:
+            return "No accounts configured"
+        full_names = [f"{account.full_name()} ({account.platform})" if account.platform else account.full_name() for account in accounts]
+        return ", ".join(full_names)
+
+    def runes(self, channel: str):
+        snapshot = self.live_games.current(channel)
+        if snapshot is None:
+            return NOT_IN_GAME
+        return snapshot.runes_response or "Could not find rune data for this game"
+
+    def champion(self, channel: str):
+        snapshot = self.live_games.current(channel)
+        if snapshot is None:
+            return NOT_IN_GAME
+        return snapshot.champion_response or "Could not find champion data for this game"
+
+    async def pros(self, channel: str):
+        snapshot = self.live_games.current(channel)
+        if snapshot is None:
+            return NOT_IN_GAME
+        result = await self.live_games.get_pros_response(snapshot)
+        if result is not None:
+            return result
+        return 'something broke - pls ping core :3'
+
+    async def rank(self, channel: str):
+        accounts = self.db.get_accounts_by_channel(channel)
         if len(accounts) == 0:
             return "No accounts configured"
         
         highest_lp = 0
         highest_rank = None
         current_rank = None
-        
-        # Check all accounts once for both in-game status and rank
-        for acc in accounts:
+        snapshot = self.live_games.current(channel)
+
+        # Check all accounts once for rank, in-game status comes from the live game snapshot.
+        # Lookups run concurrently, accounts on different platforms don't share a rate limit
+        rank_results = await asyncio.gather(*(self.riot.get_rank_for(acc) for acc in accounts), return_exceptions=True)
+        for acc, rank_result in zip(accounts, rank_results):
             try:
-                # First check if in game
-                in_game = await self.riot.get_runes_for(acc)
-                rank_result = await self.riot.get_rank_for(acc)
+                in_game = snapshot is not None and snapshot.account.id == acc.id
+                if isinstance(rank_result, Exception):
+                    raise rank_result
                 if rank_result is None:
                     continue
                 
@@ -384,71 +702,54 @@ class TwitchBot:
                     highest_rank = rank_result[0]
                 
                 # If in game, set as current rank
-                if in_game is not None:
+                if in_game:
                     current_rank = rank_result[0]
             except Exception as e:
-                print(f"[Bot] Error: {e}")
+                log.exception(f"Error: {e}")
                 return f"erm what did u do: {e}"
         if current_rank:
             return f"{current_rank}"
         else:
             return f"{highest_rank}"
     
-    # async def get_current_champion(self):
-    #     accounts = self.db.get_all_accounts()
-    #     if len(accounts) == 0:
-    #         return "No accounts configured"
-    #     for acc in accounts:
-    #         try:
-    #             result = await self.riot.get_champion_for(acc)
-    #             if result is not None:
-    #                 return result
-    #         except Exception as e:
-    #             # Something went really wrong, log it and also give the error in twitch chat
-    #             # Probably best to remove it from twitch chat later
-    #             print(f"[Bot] Error: {e}")
-    #             return f"erm what did u do: {e}"
-    #     return None
-
-    # async def is_champion(self, champion_name: str):
-    #     current_champion = await self.get_current_champion()
-    #     return current_champion == champion_name
-    
-    # async def cutoff(self):
-    #     data = await self.deeplol.get_cutoff_data()
-    #     if data is None:
-    #         return "Failed to get cutoff data"
-        
-    #     # Calculate time until 1:45 GMT+3 (22:45 UTC)
-    #     now_utc = time.gmtime()
-    #     target_hour = 22  # 1:45 GMT+3 = 22:45 UTC
-    #     target_minute = 45
-        
-    #     # Create target time for today in UTC
-    #     target_time = time.struct_time((
-    #         now_utc.tm_year, now_utc.tm_mon, now_utc.tm_mday,
-    #         target_hour, target_minute, 0,
-    #         now_utc.tm_wday, now_utc.tm_yday, now_utc.tm_isdst
-    #     ))
-        
-    #     # Convert to seconds since epoch
-    #     now_seconds = time.mktime(now_utc)
-    #     target_seconds = time.mktime(target_time)
-        
-    #     # If target time has passed today, add 24 hours
-    #     if target_seconds < now_seconds:
-    #         target_seconds += 24 * 3600
-            
-    #     # Calculate remaining seconds
-    #     remaining_seconds = int(target_seconds - now_seconds)
-        
-    #     # Convert to HH:MM:SS
-    #     hours = remaining_seconds // 3600
-    #     minutes = (remaining_seconds % 3600) // 60
-    #     seconds = remaining_seconds % 60
-    #     time_to_update = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        
-    #     return f"Challenger: {data['challenger']}LP | Grandmaster: {data['grandmaster']}LP | Next update in {time_to_update}"
+    async def cutoff(self):
+        # The local ladder mirror answers instantly, deeplol is only asked while the mirror isn't loaded
+        data = self.ladder.cutoffs() or await self.cutoffs.get()
+        if data is None:
+            return "Failed to get cutoff data"
+
+        time_to_update = self.cutoffs.time_to_update(time.time())
+        return f"Challenger: {data['challenger']}LP | Grandmaster: {data['grandmaster']}LP | Next update in {time_to_update}"
+
+    def ladder_rank(self, channel: str):
+        result = self.ladder.ladder_rank(self.db.get_accounts_by_channel(channel))
+        return result or "Ladder is still loading, try again in a bit"
+
+    # Match history commands, answered from the local match tables
+    async def champion_stats(self, channel: str, champion_name: str):
+        champion_json = await self.riot.champion_cache.get(self.riot.session)
+        return self.match_history.champion_stats(self.db.get_accounts_by_channel(channel), champion_json, champion_name)
+
+    async def last_game(self, channel: str):
+        champion_json = await self.riot.champion_cache.get(self.riot.session)
+        return self.match_history.last_game(self.db.get_accounts_by_channel(channel), champion_json)
+
+    def _parse_duration(self, value: str):
+        units = {"s": 1, "m": 60}
+        multiplier = units.get(value[-1:], None)
+        if multiplier is not None:
+            value = value[:-1]
+        if not value.isdigit():
+            return None
+        return int(value) * (multiplier or 1)
+
+    async def profile(self, channel: str, duration: int):
+        if profiler.enabled:
+            return "Already profiling"
+        self.send_without_mention(channel, f"Profiling for {duration}s...")
+        _, summary_path = await profiler.run(duration)
+        top = ", ".join(f"{name} {stats.total * 1000:.0f}ms ({stats.count}x)" for name, stats in profiler.top_spans(3))
+        return f"Profile written to {summary_path}. Top: {top or 'no spans recorded'}"
 
     # Keyword command management methods
     async def add_keyword_command(self, channel: str, name: str, keywords: list[str], message: str):
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from collections import Counter, defaultdict
+
+from db import Database
+from log import get_logger
+
+log = get_logger("UsageStats")
+
+FLUSH_INTERVAL = 60
+
+
+def current_hour(now: float):
+    return int(now) // 3600 * 3600
+
+
+class UsageStats:
+    def __init__(self):
+        # (channel, command, hour) -> count, not written to the database yet
+        self.pending: Counter = Counter()
+        # channel -> command -> all-time count, used to order the keyword matcher
+        self.totals: dict[str, Counter] = defaultdict(Counter)
+        for channel_name, command, count in Database().get_command_usage_totals():
+            self.totals[channel_name][command] = count
+
+    def record(self, channel: str, command: str):
+        channel = channel.lower().strip()
+        self.pending[(channel, command, current_hour(time.time()))] += 1
+        self.totals[channel][command] += 1
+
+    def usage_for(self, channel: str):
+        return self.totals[channel.lower().strip()]
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = Counter()
+        try:
+            await asyncio.to_thread(lambda: Database().add_command_usage(batch))
+        except Exception:
+            # e.g. database is locked, the counts are added to the next flush instead of being lost
+            self.pending.update(batch)
+            raise
+
+    async def flush_forever(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"Error while flushing: {e}")
+
+    async def top(self, channel: str, hours: int, limit: int = 5):
+        await self.flush()
+        since = current_hour(time.time()) - (hours - 1) * 3600
+        usage = await asyncio.to_thread(lambda: Database().get_command_usage_since(channel, since))
+        if len(usage) == 0:
+            return f"No commands used in the last {hours}h"
+        formatted = ", ".join(f"{command} ({count})" for command, count in usage[:limit])
+        return f"Top commands in the last {hours}h: {formatted}"